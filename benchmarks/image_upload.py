@@ -0,0 +1,83 @@
+"""
+Measure time and peak memory per megapixel of image uploads.
+
+    python -m benchmarks.image_upload --megapixels 1 4 12
+
+Compares the array-backed path (load_image_array + image_statistics) with the previous
+per-pixel DataFrame. Results are printed as JSON.
+"""
+import argparse
+import io
+import json
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+from PIL import Image
+
+from file_handlers import image_statistics, load_image_array
+
+
+def make_jpeg(megapixels, seed=0):
+    """Generate a noisy RGB JPEG of roughly `megapixels` million pixels (4:3)."""
+    height = int((megapixels * 1e6 * 3 / 4) ** 0.5)
+    width = int(height * 4 / 3)
+    rng = np.random.default_rng(seed)
+    gradient = np.linspace(0, 255, width, dtype=np.float32)[None, :, None]
+    pixels = np.clip(gradient + rng.normal(0, 30, (height, width, 3)), 0, 255).astype(np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, "JPEG", quality=90)
+    return buffer.getvalue()
+
+
+def per_pixel_dataframe(image_bytes):
+    # The previous implementation: one boxed DataFrame row per pixel
+    img = Image.open(io.BytesIO(image_bytes)).convert('L')
+    return pd.DataFrame(list(img.getdata()), columns=['pixel']).iloc[:, 0]
+
+
+def array_backed(image_bytes):
+    return image_statistics(load_image_array(io.BytesIO(image_bytes)))
+
+
+def measure(func, image_bytes):
+    tracemalloc.start()
+    started = time.perf_counter()
+    func(image_bytes)
+    seconds = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return seconds, peak
+
+
+def run(megapixel_sizes, include_baseline):
+    results = []
+    for megapixels in megapixel_sizes:
+        image_bytes = make_jpeg(megapixels)
+        entry = {"megapixels": megapixels}
+        paths = [("array", array_backed)]
+        if include_baseline:
+            paths.append(("per_pixel_dataframe", per_pixel_dataframe))
+        for name, func in paths:
+            seconds, peak = measure(func, image_bytes)
+            entry[name] = {
+                "seconds": seconds,
+                "peak_mb": peak / 1e6,
+                "seconds_per_megapixel": seconds / megapixels,
+                "peak_mb_per_megapixel": peak / 1e6 / megapixels,
+            }
+        results.append(entry)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--megapixels", type=float, nargs="+", default=[1, 4, 12])
+    parser.add_argument("--no-baseline", action="store_true", help="Skip the per-pixel DataFrame baseline")
+    args = parser.parse_args()
+    print(json.dumps(run(args.megapixels, not args.no_baseline), indent=2))
+
+
+if __name__ == "__main__":
+    main()
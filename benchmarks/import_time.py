@@ -0,0 +1,81 @@
+"""
+Measure the cold import time of the app's modules and which heavy libraries each one pulls in.
+
+    python -m benchmarks.import_time --repeat 5
+
+Every measurement runs in a fresh interpreter, like a new worker process or session cold start.
+The first use of each upload parser is timed too, since that is where its library is now imported.
+Results are printed as JSON.
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+# Modules the Streamlit script imports at start-up
+APP_MODULES = ["database", "llm", "utils", "metrics", "retrieval", "index_advisor", "file_handlers", "visualizations"]
+# Third-party libraries that are only needed for some requests
+HEAVY_LIBRARIES = ["docx", "PIL", "fitz", "pymupdf", "openai", "matplotlib", "requests", "openpyxl"]
+
+IMPORT_SCRIPT = """
+import json, sys, time
+started = time.perf_counter()
+for name in {modules!r}:
+    __import__(name)
+seconds = time.perf_counter() - started
+print(json.dumps({{"seconds": seconds, "loaded": [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+# Imports deferred to first use, timed after a cold import of the app modules
+FIRST_USE = {
+    "docx": "import docx",
+    "image": "from PIL import Image",
+    "pdf": "import pymupdf",
+    "openai": "import openai",
+    "matplotlib": "from matplotlib.figure import Figure",
+    "requests": "import requests",
+}
+FIRST_USE_SCRIPT = """
+import time
+import file_handlers, visualizations
+started = time.perf_counter()
+{statement}
+print(time.perf_counter() - started)
+"""
+
+
+def run_python(script):
+    result = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True, check=True)
+    return result.stdout.strip().splitlines()[-1]
+
+
+def measure_imports(modules, repeat):
+    runs = [json.loads(run_python(IMPORT_SCRIPT.format(modules=modules, heavy=HEAVY_LIBRARIES)))
+            for _ in range(repeat)]
+    timings = [run["seconds"] for run in runs]
+    return {"median_ms": statistics.median(timings) * 1000, "min_ms": min(timings) * 1000,
+            "loaded": runs[-1]["loaded"]}
+
+
+def run(repeat):
+    results = {"app": measure_imports(APP_MODULES, repeat)}
+    for module in APP_MODULES:
+        results[module] = measure_imports([module], repeat)
+    results["first_use"] = {
+        name: statistics.median(float(run_python(FIRST_USE_SCRIPT.format(statement=statement)))
+                                for _ in range(repeat)) * 1000
+        for name, statement in FIRST_USE.items()
+    }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    print(json.dumps(run(args.repeat), indent=2))
+
+
+if __name__ == "__main__":
+    main()
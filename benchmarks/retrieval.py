@@ -0,0 +1,82 @@
+"""
+Measure BM25 retrieval over a large synthetic document: index build time, search latency and the
+prompt tokens saved by sending the top chunks instead of the whole text.
+
+    python -m benchmarks.retrieval --pages 2000
+
+Results are printed as JSON.
+"""
+import argparse
+import json
+import statistics
+import time
+
+import numpy as np
+
+from llm import estimate_tokens
+from retrieval import BM25Index, relevant_excerpts
+
+WORDS_PER_PAGE = 500
+VOCABULARY_SIZE = 20_000
+PLANTED = "the quarterly revenue forecast for the northern warehouse was revised downward"
+QUERIES = [
+    "What was the quarterly revenue forecast for the northern warehouse?",
+    "northern warehouse",
+    "forecast revised",
+    "w1 w2 w3",  # Very common terms
+    "nothing matches this",
+]
+
+
+def make_document(pages, seed=0):
+    """Zipf-distributed pseudo-words, with one known passage planted in the middle."""
+    rng = np.random.default_rng(seed)
+    ranks = np.minimum(rng.zipf(1.2, pages * WORDS_PER_PAGE), VOCABULARY_SIZE)
+    words = [f"w{rank}" for rank in ranks]
+    page_texts = [" ".join(words[i:i + WORDS_PER_PAGE]) for i in range(0, len(words), WORDS_PER_PAGE)]
+    page_texts[pages // 2] += " " + PLANTED
+    return "\n".join(page_texts)
+
+
+def run(pages, repeat):
+    text = make_document(pages)
+    started = time.perf_counter()
+    index = BM25Index.from_text(text)
+    build_seconds = time.perf_counter() - started
+
+    queries = []
+    for query in QUERIES:
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            results = index.search(query, k=4)
+            timings.append(time.perf_counter() - started)
+        excerpts, count = relevant_excerpts(index, query)
+        queries.append({
+            "query": query,
+            "median_ms": statistics.median(timings) * 1000,
+            "max_ms": max(timings) * 1000,
+            "top_chunk_has_passage": bool(results) and PLANTED in index.chunks[results[0][0]],
+            "excerpts": count,
+            "excerpt_tokens": estimate_tokens(excerpts),
+        })
+
+    return {
+        "pages": pages,
+        "chunks": len(index),
+        "document_tokens": estimate_tokens(text),
+        "build_seconds": build_seconds,
+        "queries": queries,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+    print(json.dumps(run(args.pages, args.repeat), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""
+Generate scaled-up copies of chinook.db for benchmarking.
+
+    python -m benchmarks.scale_db --factor 100 --output chinook_x100.db
+
+Every row is copied `factor - 1` times. Integer columns whose name ends in "Id" are shifted
+by a fixed offset per copy, so primary keys stay unique and foreign keys stay consistent.
+"""
+import argparse
+import os
+import shutil
+import sqlite3
+import time
+from contextlib import closing
+
+ID_OFFSET = 10_000_000  # Larger than any id in chinook.db
+
+
+def scale_database(source_path, output_path, factor):
+    """Write a copy of `source_path` to `output_path` with every table `factor` times larger."""
+    shutil.copyfile(source_path, output_path)
+    with closing(sqlite3.connect(output_path)) as conn:
+        conn.execute("PRAGMA journal_mode = OFF")
+        conn.execute("PRAGMA synchronous = OFF")
+        tables = [row[0] for row in conn.execute(
+            "SELECT name FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%'"
+        )]
+        for table in tables:
+            columns = conn.execute(f'PRAGMA table_info("{table}")').fetchall()
+            max_rowid = conn.execute(f'SELECT max(rowid) FROM "{table}"').fetchone()[0]
+            if max_rowid is None:
+                continue
+            for copy in range(1, factor):
+                expressions = [
+                    f'"{name}" + {copy * ID_OFFSET}' if name.endswith("Id") and "INT" in col_type.upper()
+                    else f'"{name}"'
+                    for _, name, col_type, *_ in columns
+                ]
+                conn.execute(
+                    f'INSERT INTO "{table}" SELECT {", ".join(expressions)} FROM "{table}" WHERE rowid <= ?',
+                    (max_rowid,),
+                )
+        conn.commit()
+    return output_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--source", default="chinook.db")
+    parser.add_argument("--factor", type=int, default=10)
+    parser.add_argument("--output", default=None)
+    args = parser.parse_args()
+
+    output = args.output or f"{os.path.splitext(args.source)[0]}_x{args.factor}.db"
+    started = time.perf_counter()
+    scale_database(args.source, output, args.factor)
+    print(f"Wrote {output} ({os.path.getsize(output) / 1e6:.1f} MB) in {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
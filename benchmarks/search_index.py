@@ -0,0 +1,88 @@
+"""
+Compare substring lookups through the trigram search index (MATCH) against LIKE scans.
+
+    python -m benchmarks.search_index --factor 1000
+
+With --factor 1000 the tracks table grows to ~3.5 million rows. Results are printed as JSON.
+"""
+import argparse
+import contextlib
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+import database
+from benchmarks.scale_db import scale_database
+
+# (table, column, search value) lookups typical of chat questions
+LOOKUPS = [
+    ("tracks", "Name", "Wall"),
+    ("tracks", "Composer", "Angus Young"),
+    ("albums", "Title", "Greatest"),
+    ("artists", "Name", "AC/DC"),
+    ("customers", "Country", "Brazil"),
+]
+
+
+def time_lookup(conn, catalog, table, column, value, repeat):
+    condition, params = database.substring_filter(catalog, table, column, value)
+    query = f"SELECT * FROM {database.quote_identifier(table)} WHERE {condition}"
+    timings = []
+    rows = 0
+    for _ in range(repeat):
+        started = time.perf_counter()
+        rows = len(conn.execute(query, params).fetchall())
+        timings.append(time.perf_counter() - started)
+    return {"median_ms": statistics.median(timings) * 1000, "rows": rows}
+
+
+def run(source, factor, repeat):
+    with tempfile.TemporaryDirectory() as workdir:
+        db_path = os.path.join(workdir, "scaled.db")
+        scale_database(source, db_path, factor)
+
+        started = time.perf_counter()
+        database.build_search_index(db_path)
+        build_seconds = time.perf_counter() - started
+
+        conn = database.connect_to_db(db_path)
+        catalog = database.get_schema_catalog(conn)
+        like_catalog = database.SchemaCatalog(catalog.schema_version, catalog.tables)  # No search tables
+
+        results = []
+        for table, column, value in LOOKUPS:
+            results.append({
+                "table": table,
+                "column": column,
+                "value": value,
+                "like": time_lookup(conn, like_catalog, table, column, value, repeat),
+                "match": time_lookup(conn, catalog, table, column, value, repeat),
+            })
+        track_count = conn.execute("SELECT count(*) FROM tracks").fetchone()[0]
+        conn.close()
+
+    return {
+        "factor": factor,
+        "tracks": track_count,
+        "index_build_seconds": build_seconds,
+        "lookups": results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--source", default="chinook.db")
+    parser.add_argument("--factor", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    # Keep stdout for the JSON report; connect_to_db prints connection messages
+    with contextlib.redirect_stdout(sys.stderr):
+        results = run(args.source, args.factor, args.repeat)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,28 @@
+"""
+Local stand-ins for Streamlit's uploaded files and the OpenAI streaming endpoint, shared by the
+benchmarks and the tests. Importing this module has no side effects.
+"""
+import io
+import types
+
+
+class StubUpload(io.BytesIO):
+    """Stand-in for Streamlit's UploadedFile."""
+
+    def __init__(self, content, name, mime_type):
+        super().__init__(content)
+        self.name = name
+        self.type = mime_type
+        self.size = len(content)
+        self.file_id = f"{name}-{len(content)}"
+
+
+def stub_completion(reply, chunk_size=8):
+    """A local stand-in for openai.chat.completions.create that streams `reply` in chunks."""
+    def create(stream=False, **kwargs):
+        chunks = [reply[i:i + chunk_size] for i in range(0, len(reply), chunk_size)]
+        for text in chunks:
+            yield types.SimpleNamespace(usage=None, choices=[
+                types.SimpleNamespace(delta=types.SimpleNamespace(content=text))])
+        yield types.SimpleNamespace(usage=types.SimpleNamespace(prompt_tokens=0, completion_tokens=0), choices=[])
+    return create
@@ -0,0 +1,287 @@
+"""
+Offline benchmark suite for the chatbot's hot paths.
+
+    python -m benchmarks.suite --output results.json
+    python -m benchmarks.suite --quick --compare results.json
+
+Covers database lookups (exact and substring) on chinook.db and scaled copies, the chat
+history store, every branch of file_handlers.handle_uploaded_file on generated inputs of
+increasing size, the chart functions, and a full chat turn with the LLM replaced by a local
+stub. Results are written as JSON; --compare prints the ratio against an earlier run.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import warnings
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.scale_db import scale_database
+from benchmarks.stubs import StubUpload, stub_completion
+
+# (table, column, value, exact) lookups typical of chat questions
+LOOKUPS = [
+    ("tracks", "Name", "Balls to the Wall", True),
+    ("customers", "Country", "Brazil", True),
+    ("tracks", "Name", "Love", False),
+    ("artists", "Name", "AC/DC", False),
+]
+
+
+def measure(func, repeat):
+    """Run `func` `repeat` times; return timing statistics in milliseconds."""
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - started) * 1000)
+    return {"median_ms": statistics.median(timings), "min_ms": min(timings), "max_ms": max(timings),
+            "repeat": repeat}
+
+
+def bench_database(workdir, scales, repeat):
+    import database
+
+    results = []
+    for factor in scales:
+        db_path = os.path.join(workdir, f"chinook_x{factor}.db")
+        if factor == 1:
+            shutil.copyfile("chinook.db", db_path)
+        else:
+            scale_database("chinook.db", db_path, factor)
+        for with_index in (False, True):
+            if with_index:
+                database.build_search_index(db_path)
+            pool = database.ConnectionPool(db_path)
+            for table, column, value, exact in LOOKUPS:
+                def lookup():
+                    with pool.connection() as conn:
+                        database.execute_dynamic_query(conn, table, column, value, exact_match=exact)
+
+                lookup()  # Warm the pool and the schema catalog
+                results.append({
+                    "scale": factor, "search_index": with_index, "table": table, "column": column,
+                    "value": value, "mode": "exact" if exact else "like", **measure(lookup, repeat),
+                })
+            pool.reset()
+    return results
+
+
+def bench_chat_history(workdir, sizes, repeat):
+    import utils
+
+    utils.CHAT_HISTORY_DB = os.path.join(workdir, "chat_history.db")
+    results = []
+    for size in sizes:
+        session_id = f"bench-{size}"
+        for i in range(size):
+            utils.append_chat_message(session_id, {"role": "user", "content": f"Message {i} " * 20})
+        counter = iter(range(10 ** 9))
+        results.append({
+            "history_messages": size,
+            "append": measure(lambda: utils.append_chat_message(
+                session_id, {"role": "assistant", "content": f"Reply {next(counter)}"}), repeat),
+            "load_recent": measure(lambda: utils.load_chat_history(session_id), repeat),
+        })
+    return results
+
+
+def make_uploads(rows):
+    """Generate one upload per handle_uploaded_file branch, sized by `rows`."""
+    import docx
+    import pymupdf
+    from PIL import Image
+
+    rng = np.random.default_rng(rows)
+    df = pd.DataFrame({
+        "id": np.arange(rows),
+        "category": rng.choice(["rock", "jazz", "pop", "metal", "blues"], rows),
+        "value": rng.random(rows),
+    })
+    uploads = {"csv": StubUpload(df.to_csv(index=False).encode(), "data.csv", "text/csv")}
+
+    buffer = io.BytesIO()
+    df.head(min(rows, 50_000)).to_excel(buffer, index=False)
+    uploads["xlsx"] = StubUpload(buffer.getvalue(), "data.xlsx",
+                                  "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
+
+    text = "\n".join(f"Line {i}: the quick brown fox jumps over the lazy dog." for i in range(rows // 10))
+    uploads["txt"] = StubUpload(text.encode(), "notes.txt", "text/plain")
+
+    pages = max(rows // 1000, 1)
+    pdf = pymupdf.open()
+    for page_number in range(pages):
+        page = pdf.new_page()
+        page.insert_text((72, 72), f"Page {page_number}\n" + "Lorem ipsum dolor sit amet. " * 40)
+    uploads["pdf"] = StubUpload(pdf.tobytes(), "doc.pdf", "application/pdf")
+
+    document = docx.Document()
+    for i in range(max(rows // 100, 1)):
+        document.add_paragraph(f"Paragraph {i}: " + "Lorem ipsum dolor sit amet. " * 5)
+    buffer = io.BytesIO()
+    document.save(buffer)
+    uploads["docx"] = StubUpload(buffer.getvalue(), "doc.docx",
+                                  "application/vnd.openxmlformats-officedocument.wordprocessingml.document")
+
+    side = int(max(rows, 1000) ** 0.5 * 10)
+    image = (rng.random((side, side, 3)) * 255).astype(np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(image).save(buffer, "PNG")
+    uploads["png"] = StubUpload(buffer.getvalue(), "image.png", "image/png")
+    return uploads
+
+
+def bench_uploads(workdir, sizes, repeat):
+    import file_handlers
+
+    results = []
+    for rows in sizes:
+        for kind, upload in make_uploads(rows).items():
+            cache = file_handlers.ParsedUploadCache(spill_dir=None)
+
+            def parse(cache=None, upload=upload):
+                upload.seek(0)
+                file_handlers.handle_uploaded_file(upload, cache_dir=workdir, cache=cache)
+
+            parse(cache)  # Fill the cache for the rerun measurement
+            results.append({
+                "kind": kind, "rows": rows, "bytes": upload.size,
+                "parse": measure(parse, repeat),
+                "rerun_cached": measure(lambda: parse(cache), repeat),
+            })
+    return results
+
+
+def bench_charts(sizes, repeat):
+    import visualizations
+
+    results = []
+    for rows in sizes:
+        rng = np.random.default_rng(rows)
+        df = pd.DataFrame({
+            "id": np.arange(rows),
+            "category": rng.choice([f"genre {i}" for i in range(20)], rows),
+            "value": rng.random(rows),
+        })
+
+        def pie():
+            visualizations._chart_cache.clear()
+            visualizations.generate_pie_chart(df, "category", 0, rows)
+
+        def bar():
+            visualizations._chart_cache.clear()
+            visualizations.generate_bar_chart(df, "id", "value", 0, rows, 0, rows)
+
+        results.append({
+            "rows": rows,
+            "pie": measure(pie, repeat),
+            "pie_cached": measure(lambda: visualizations.generate_pie_chart(df, "category", 0, rows), repeat),
+            "bar": measure(bar, repeat),
+            "bar_cached": measure(lambda: visualizations.generate_bar_chart(df, "id", "value", 0, rows, 0, rows),
+                                  repeat),
+        })
+    return results
+
+
+def bench_chat_turn(history_sizes, repeat):
+    import database
+    import llm
+
+    pool = database.ConnectionPool("chinook.db")
+    with pool.connection() as conn:
+        schema = database.get_schema_catalog(conn).describe()
+    create = stub_completion("Let me look that up.\nquery: tracks|Name|Love\nquery: customers|Country|Brazil\n")
+
+    results = []
+    for size in history_sizes:
+        messages = [{"role": "user" if i % 2 == 0 else "assistant", "content": f"Turn {i}. " + "words " * 60}
+                    for i in range(size)]
+
+        def turn():
+            conversation, _ = llm.build_context(schema, messages)
+            directives = []
+            llm.stream_completion(create, on_directive=directives.append, model="stub", messages=conversation)
+            for directive in directives:
+                table, column, value = [part.strip() for part in directive.split("|")]
+                with pool.connection() as conn:
+                    database.fetch_query_page(conn, table, column, value)
+
+        results.append({"history_messages": size, **measure(turn, repeat)})
+    return results
+
+
+def environment():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = None
+    return {"python": platform.python_version(), "platform": platform.platform(),
+            "cpu_count": os.cpu_count(), "git_commit": commit, "timestamp": time.time()}
+
+
+def run(quick=False, repeat=5):
+    scales = [1, 10] if quick else [1, 10, 100]
+    sizes = [1_000, 10_000] if quick else [1_000, 10_000, 100_000]
+    history = [10, 100] if quick else [10, 100, 1_000, 10_000]
+    with tempfile.TemporaryDirectory() as workdir:
+        return {
+            "environment": environment(),
+            "database": bench_database(workdir, scales, repeat),
+            "chat_history": bench_chat_history(workdir, history, repeat),
+            "uploads": bench_uploads(workdir, sizes, repeat),
+            "charts": bench_charts(sizes, repeat),
+            "chat_turn": bench_chat_turn(history, repeat),
+        }
+
+
+def compare(current, baseline, path=""):
+    """Yield (path, baseline_ms, current_ms) for every median timing present in both runs."""
+    if isinstance(current, dict) and isinstance(baseline, dict):
+        if "median_ms" in current and "median_ms" in baseline:
+            yield path, baseline["median_ms"], current["median_ms"]
+        for key in current:
+            if key in baseline and key != "environment":
+                yield from compare(current[key], baseline[key], f"{path}.{key}" if path else key)
+    elif isinstance(current, list) and isinstance(baseline, list):
+        for i, (cur, base) in enumerate(zip(current, baseline)):
+            yield from compare(cur, base, f"{path}[{i}]")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--output", help="Write results to this JSON file (default: stdout)")
+    parser.add_argument("--compare", help="Earlier results JSON to compare against")
+    parser.add_argument("--quick", action="store_true", help="Smaller inputs, for a fast check")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    # Library deprecation warnings would interleave with the report; only while benchmarking
+    warnings.filterwarnings("ignore")
+
+    # Keep stdout for the JSON report; the modules under test print connection messages
+    with contextlib.redirect_stdout(sys.stderr):
+        results = run(quick=args.quick, repeat=args.repeat)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    else:
+        print(json.dumps(results, indent=2))
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        for path, before, after in compare(results, baseline):
+            print(f"{path}: {before:.2f} ms -> {after:.2f} ms ({after / before if before else float('inf'):.2f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,141 @@
 import sqlite3
 import os
+import json
+import time
+import hashlib
+import tempfile
+import threading
+from contextlib import closing, contextmanager, nullcontext
+from urllib.parse import quote
+from metrics import record, timed
 
-def connect_to_db(db_path):
+# Sidecar file recording the validators of the last successful download
+DB_METADATA_SUFFIX = ".meta.json"
+
+# Chunk size used when streaming the database to disk
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
+# Read-only tuning applied to pooled connections
+MMAP_SIZE = 256 * 1024 * 1024  # Bytes of the file to memory-map
+CACHE_SIZE_KB = 64 * 1024  # Page cache per connection, in KiB
+POOL_SIZE = 8  # Maximum connections per database file
+POOL_TIMEOUT = 30  # Seconds to wait for a free connection before giving up
+STATEMENT_CACHE_SIZE = 256  # Prepared statements kept per connection; lookups of the same shape share one
+
+# Sidecar database holding the trigram full-text index of the text columns
+SEARCH_INDEX_SUFFIX = ".search.db"
+SEARCH_SCHEMA = "search"  # Name the sidecar is attached under
+MIN_TRIGRAM_LENGTH = 3  # Shorter search values cannot use a trigram index
+
+# Result paging for chat lookups
+PAGE_SIZE = 50  # Rows fetched per page
+QUERY_TIMEOUT = 5  # Seconds a single lookup may run before it is interrupted
+PROGRESS_HANDLER_OPS = 1000  # SQLite VM instructions between deadline checks
+
+_fetch_lock = threading.Lock()
+
+
+def _read_db_metadata(db_path):
+    try:
+        with open(db_path + DB_METADATA_SUFFIX, 'r') as file:
+            return json.load(file)
+    except (OSError, json.JSONDecodeError):
+        return {}
+
+
+def _write_db_metadata(db_path, metadata):
+    # Write to a temp file first so a crash never leaves half-written metadata behind
+    directory = os.path.dirname(os.path.abspath(db_path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    with os.fdopen(fd, 'w') as file:
+        json.dump(metadata, file)
+    os.replace(tmp_path, db_path + DB_METADATA_SUFFIX)
+
+
+@timed("db.fetch")
+def fetch_database(url, db_path, max_age=3600, timeout=30):
+    """
+    Download the database at `url` to `db_path`, transferring it only when it has changed.
+
+    The local copy is considered fresh for `max_age` seconds after the last check, during which
+    no request is made at all. After that the file is revalidated with ETag/Last-Modified, and a
+    full download is written to a temp file and swapped in atomically, so sessions still reading
+    the old file are never handed a partially written one.
+
+    Returns a tuple (status, error) where status is one of 'fresh', 'not-modified' or 'updated'.
+    """
+    with _fetch_lock:
+        metadata = _read_db_metadata(db_path)
+        local_ok = os.path.exists(db_path) and os.path.getsize(db_path) == metadata.get("size")
+
+        # Skip the network entirely while the local copy is still fresh
+        if local_ok and time.time() - metadata.get("checked_at", 0) < max_age:
+            return "fresh", None
+
+        import requests  # Only needed once the local copy has to be revalidated
+
+        headers = {}
+        if local_ok:
+            if metadata.get("etag"):
+                headers["If-None-Match"] = metadata["etag"]
+            if metadata.get("last_modified"):
+                headers["If-Modified-Since"] = metadata["last_modified"]
+
+        try:
+            with requests.get(url, headers=headers, stream=True, timeout=timeout) as response:
+                if response.status_code == 304 and local_ok:
+                    metadata["checked_at"] = time.time()
+                    _write_db_metadata(db_path, metadata)
+                    return "not-modified", None
+                if response.status_code != 200:
+                    return None, f"Failed to download the database. Status code: {response.status_code}"
+
+                # Stream into a temp file next to the target so os.replace stays atomic
+                directory = os.path.dirname(os.path.abspath(db_path))
+                fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".download")
+                digest = hashlib.sha256()
+                size = 0
+                try:
+                    with os.fdopen(fd, 'wb') as file:
+                        for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                            file.write(chunk)
+                            digest.update(chunk)
+                            size += len(chunk)
+
+                    if size == 0:
+                        return None, "Downloaded database is empty or invalid."
+
+                    # Identical content: keep the existing file (and its warm page cache)
+                    if local_ok and digest.hexdigest() == metadata.get("sha256"):
+                        status = "not-modified"
+                    else:
+                        os.replace(tmp_path, db_path)
+                        status = "updated"
+                finally:
+                    if os.path.exists(tmp_path):
+                        os.remove(tmp_path)
+
+                _write_db_metadata(db_path, {
+                    "url": url,
+                    "etag": response.headers.get("ETag"),
+                    "last_modified": response.headers.get("Last-Modified"),
+                    "sha256": digest.hexdigest(),
+                    "size": size,
+                    "checked_at": time.time(),
+                })
+                return status, None
+        except requests.RequestException as e:
+            # Keep serving the copy we already have if the network is unavailable
+            if local_ok:
+                return "fresh", None
+            return None, f"Error downloading database: {e}"
+
+
+@timed("db.connect")
+def connect_to_db(db_path, read_only=True):
     """
     Connect to the SQLite database at the given path. Handles errors gracefully and checks if the file exists.
+    By default the file is opened read-only (URI mode=ro) and tuned for read-heavy lookups.
     """
     try:
         # Check if the database file exists
@@ -11,7 +143,21 @@ def connect_to_db(db_path):
             raise FileNotFoundError(f"Database file not found at: {db_path}")
         
         print(f"Trying to connect to database at {db_path}")
-        conn = sqlite3.connect(db_path)
+        if read_only:
+            uri = f"file:{quote(os.path.abspath(db_path))}?mode=ro"
+            # check_same_thread=False: pooled connections are handed to one thread at a time
+            conn = sqlite3.connect(uri, uri=True, check_same_thread=False,
+                                   cached_statements=STATEMENT_CACHE_SIZE)
+            # Attach the full-text search sidecar when one has been built for this file
+            index_path = db_path + SEARCH_INDEX_SUFFIX
+            if os.path.exists(index_path):
+                conn.execute(f"ATTACH DATABASE ? AS {SEARCH_SCHEMA}",
+                             (f"file:{quote(os.path.abspath(index_path))}?mode=ro",))
+            conn.execute(f"PRAGMA mmap_size = {MMAP_SIZE}")
+            conn.execute(f"PRAGMA cache_size = {-CACHE_SIZE_KB}")
+            conn.execute("PRAGMA query_only = ON")
+        else:
+            conn = sqlite3.connect(db_path)
         print(f"Successfully connected to database at {db_path}")
         return conn
     except sqlite3.Error as e:
@@ -25,6 +171,403 @@ def connect_to_db(db_path):
         return None
 
 
+class ConnectionPool:
+    """
+    A bounded pool of read-only connections to one database file, shared by every session
+    and rerun in the process. Use `with pool.connection() as conn:` to borrow a connection.
+    """
+
+    def __init__(self, db_path, max_size=POOL_SIZE, timeout=POOL_TIMEOUT):
+        self.db_path = db_path
+        self.max_size = max_size
+        self.timeout = timeout
+        self._idle = []  # (generation, conn); popped from the end so the most recently used (warmest) one is reused
+        self._cond = threading.Condition()  # Guards _idle and _size; notified whenever either changes
+        self._size = 0
+        self._generation = 0
+        self._checkouts = 0
+        self._waits = 0
+        self._wait_seconds = 0.0
+        self._max_wait_seconds = 0.0
+
+    def _acquire(self):
+        started = None
+        try:
+            with self._cond:
+                self._checkouts += 1
+                while True:
+                    if self._idle:
+                        return self._idle.pop()
+                    # Also reached by a waiter once a reset() retired a connection and freed its slot
+                    if self._size < self.max_size:
+                        self._size += 1
+                        generation = self._generation
+                        break
+                    # Pool exhausted: wait for another thread to return or retire a connection
+                    if started is None:
+                        self._waits += 1
+                        started = time.perf_counter()
+                    remaining = self.timeout - (time.perf_counter() - started)
+                    if remaining <= 0:
+                        raise sqlite3.OperationalError(
+                            f"Timed out after {self.timeout}s waiting for a database connection"
+                        )
+                    self._cond.wait(remaining)
+        finally:
+            if started is not None:
+                waited = time.perf_counter() - started
+                record("db.pool_wait", waited)
+                with self._cond:
+                    self._wait_seconds += waited
+                    self._max_wait_seconds = max(self._max_wait_seconds, waited)
+
+        conn = connect_to_db(self.db_path)
+        if conn is None:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise sqlite3.OperationalError(f"Unable to open database at {self.db_path}")
+        return generation, conn
+
+    def _release(self, generation, conn):
+        with self._cond:
+            # Connections opened before a reset() still point at the replaced file
+            retired = generation != self._generation
+            if retired:
+                self._size -= 1
+            else:
+                self._idle.append((generation, conn))
+            self._cond.notify()
+        if retired:
+            conn.close()
+
+    @contextmanager
+    def connection(self):
+        generation, conn = self._acquire()
+        try:
+            yield conn
+        finally:
+            self._release(generation, conn)
+
+    def reset(self):
+        """Close idle connections and retire busy ones, e.g. after the database file was replaced."""
+        with self._cond:
+            self._generation += 1
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+            self._cond.notify_all()
+        for _, conn in idle:
+            conn.close()
+
+    def stats(self):
+        """Return checkout/wait counters and the current pool size."""
+        with self._cond:
+            return {
+                "size": self._size,
+                "max_size": self.max_size,
+                "idle": len(self._idle),
+                "in_use": self._size - len(self._idle),
+                "checkouts": self._checkouts,
+                "waits": self._waits,
+                "wait_seconds": self._wait_seconds,
+                "max_wait_seconds": self._max_wait_seconds,
+            }
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_connection_pool(db_path, max_size=POOL_SIZE):
+    """Return the process-wide connection pool for `db_path`, creating it on first use."""
+    key = os.path.abspath(db_path)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = _pools[key] = ConnectionPool(db_path, max_size=max_size)
+        return pool
+
+
+def quote_identifier(name):
+    """Quote a table or column name for safe interpolation into SQL."""
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+class SchemaCatalog:
+    """
+    In-memory snapshot of the tables, columns, types and indexes of a database,
+    tagged with the `PRAGMA schema_version` it was built from.
+    """
+
+    def __init__(self, schema_version, tables, search_tables=None):
+        self.schema_version = schema_version
+        # {table: {"columns": [(name, type), ...], "indexes": [(name, [columns], unique), ...]}}
+        self.tables = tables
+        # {(table, column): fts_table} for columns covered by the attached search index
+        self.search_tables = search_tables or {}
+        self._table_lookup = {name.lower(): name for name in tables}
+        self._plans = {}  # SQL text -> whether its plan reads the table through an index
+
+    @classmethod
+    def build(cls, conn):
+        cursor = conn.cursor()
+        schema_version = cursor.execute("PRAGMA schema_version").fetchone()[0]
+        tables = {}
+        table_names = [row[0] for row in cursor.execute(
+            "SELECT name FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%' ORDER BY name"
+        )]
+        for table in table_names:
+            quoted = quote_identifier(table)
+            columns = [(col[1], col[2]) for col in cursor.execute(f"PRAGMA table_info({quoted})")]
+            indexes = []
+            for index in cursor.execute(f"PRAGMA index_list({quoted})").fetchall():
+                index_name, unique = index[1], bool(index[2])
+                index_columns = [col[2] for col in cursor.execute(
+                    f"PRAGMA index_info({quote_identifier(index_name)})"
+                )]
+                indexes.append((index_name, index_columns, unique))
+            tables[table] = {"columns": columns, "indexes": indexes}
+
+        search_tables = {}
+        attached = [row[1] for row in cursor.execute("PRAGMA database_list")]
+        if SEARCH_SCHEMA in attached:
+            for table, column, fts_table in cursor.execute(
+                f"SELECT table_name, column_name, fts_table FROM {SEARCH_SCHEMA}.search_columns"
+            ):
+                search_tables[(table, column)] = fts_table
+        return cls(schema_version, tables, search_tables)
+
+    def resolve_table(self, table_name):
+        """Return the table's name as stored in the schema (SQLite names are case-insensitive), or None."""
+        return self._table_lookup.get(str(table_name).lower())
+
+    def resolve_column(self, table_name, column_name):
+        """Return the column's name as stored in the schema, or None."""
+        table = self.resolve_table(table_name)
+        if table is None:
+            return None
+        for name, _ in self.tables[table]["columns"]:
+            if name.lower() == str(column_name).lower():
+                return name
+        return None
+
+    def columns(self, table_name):
+        table = self.resolve_table(table_name)
+        return [name for name, _ in self.tables[table]["columns"]] if table else []
+
+    def text_columns(self, table_name):
+        """Columns declared with a text affinity (the ones worth searching with LIKE)."""
+        table = self.resolve_table(table_name)
+        if table is None:
+            return []
+        return [name for name, col_type in self.tables[table]["columns"]
+                if any(t in col_type.upper() for t in ("CHAR", "CLOB", "TEXT"))]
+
+    def is_indexed(self, table_name, column_name):
+        """True if `column_name` is the leading column of an index on the table."""
+        table = self.resolve_table(table_name)
+        column = self.resolve_column(table_name, column_name)
+        if column is None:
+            return False
+        return any(cols and cols[0] == column for _, cols, _ in self.tables[table]["indexes"])
+
+    def uses_index(self, conn, sql, params, table):
+        """
+        Whether `sql` reads `table` through an index rather than scanning it, from EXPLAIN QUERY PLAN.
+        Plans are cached by SQL text, so each lookup shape is explained once per schema version.
+        """
+        uses_index = self._plans.get(sql)
+        if uses_index is None:
+            uses_index = self._plans[sql] = plan_uses_index(explain_query_plan(conn, sql, params), table)
+        return uses_index
+
+    def describe(self):
+        """Compact text description of the schema, suitable for a model prompt."""
+        lines = []
+        for table, info in self.tables.items():
+            columns = ", ".join(f"{name} {col_type}".strip() for name, col_type in info["columns"])
+            lines.append(f"{table}({columns})")
+        return "\n".join(lines)
+
+
+_catalogs = {}
+_catalogs_lock = threading.Lock()
+
+
+def get_schema_catalog(conn):
+    """
+    Return the cached SchemaCatalog for the database behind `conn`.
+    The catalog is only rebuilt when `PRAGMA schema_version` changes.
+    """
+    cursor = conn.cursor()
+    # Key on every attached file, so connections with and without the search sidecar don't share a catalog
+    db_files = tuple(row[2] for row in cursor.execute("PRAGMA database_list"))
+    schema_version = cursor.execute("PRAGMA schema_version").fetchone()[0]
+    with _catalogs_lock:
+        catalog = _catalogs.get(db_files)
+        if catalog is not None and catalog.schema_version == schema_version:
+            return catalog
+    catalog = SchemaCatalog.build(conn)
+    with _catalogs_lock:
+        _catalogs[db_files] = catalog
+    return catalog
+
+
+def explain_query_plan(conn, sql, params=()):
+    """Return the detail lines of the query plan SQLite picks for `sql`."""
+    return [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params)]
+
+
+def plan_uses_index(plan, table):
+    """
+    True if the plan finds `table`'s rows through an index (or single rowid lookups)
+    instead of scanning the table or a rowid range of it.
+    """
+    uses_index = False
+    for detail in plan:
+        action, _, rest = detail.partition(" ")
+        if rest.split(" ", 1)[0] != table:
+            continue
+        if action == "SCAN":
+            return False
+        if action == "SEARCH":
+            if "INTEGER PRIMARY KEY" in rest and "(rowid=?)" not in rest:
+                return False  # A rowid range, e.g. the keyset pagination condition alone
+            uses_index = True
+    return uses_index
+
+
+class QueryStats:
+    """
+    Per (table, column, match mode) counters of the lookups run in this process: how many there were,
+    how many read the table through an index vs. scanned it, and the time they took.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def record(self, table, column, mode, uses_index, seconds, sql, params):
+        with self._lock:
+            stats = self._stats.get((table, column, mode))
+            if stats is None:
+                stats = self._stats[(table, column, mode)] = {"lookups": 0, "index": 0, "scans": 0, "seconds": 0.0}
+            stats["lookups"] += 1
+            stats["index" if uses_index else "scans"] += 1
+            stats["seconds"] += seconds
+            stats["sample"] = (sql, params)  # Latest statement of this shape, to explain it again later
+
+    def snapshot(self):
+        """{(table, column, mode): counters}, copied so the caller can read it without the lock."""
+        with self._lock:
+            return {key: dict(stats) for key, stats in self._stats.items()}
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+
+
+query_stats = QueryStats()
+
+
+def lookup_filter(catalog, table, column, search_value, exact_match):
+    """Return (mode, sql, params) of the WHERE clause of a lookup; mode is 'exact', 'match' or 'like'."""
+    if exact_match:
+        return "exact", f"{quote_identifier(column)} = ?", (search_value,)
+    condition, params = substring_filter(catalog, table, column, search_value)
+    return ("match" if " MATCH " in condition else "like"), condition, params
+
+
+def substring_filter(catalog, table, column, search_value):
+    """
+    Return (sql, params) for a WHERE clause matching `search_value` anywhere in the column.
+    Uses the trigram index (MATCH) when one covers the column, otherwise falls back to LIKE.
+    """
+    fts_table = catalog.search_tables.get((table, column))
+    # LIKE wildcards in the value have no MATCH equivalent, so keep those on the LIKE path
+    if (fts_table and len(search_value) >= MIN_TRIGRAM_LENGTH
+            and '%' not in search_value and '_' not in search_value):
+        phrase = '"' + search_value.replace('"', '""') + '"'
+        return (f"rowid IN (SELECT rowid FROM {SEARCH_SCHEMA}.{quote_identifier(fts_table)} WHERE value MATCH ?)",
+                (phrase,))
+    return f"{quote_identifier(column)} LIKE ?", ('%' + search_value + '%',)
+
+
+def source_stamp(db_path):
+    stat = os.stat(db_path)
+    return f"{stat.st_size}:{stat.st_mtime_ns}"
+
+
+@timed("db.search_index")
+def build_search_index(db_path):
+    """
+    Build a trigram FTS5 index of every text column of `db_path` in a sidecar database.
+    The index is rebuilt only when the database file changed since the last build.
+
+    Returns True if the index was (re)built, False if it was already up to date.
+    """
+    index_path = db_path + SEARCH_INDEX_SUFFIX
+    stamp = source_stamp(db_path)
+    if os.path.exists(index_path):
+        try:
+            with closing(sqlite3.connect(index_path)) as existing:
+                built_from = existing.execute("SELECT value FROM search_meta WHERE key = 'source'").fetchone()
+            if built_from and built_from[0] == stamp:
+                return False
+        except sqlite3.Error:
+            pass  # Unreadable or from an older layout: rebuild it
+
+    # Build into a temp file and swap it in, like the database download
+    directory = os.path.dirname(os.path.abspath(db_path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".search")
+    os.close(fd)
+    try:
+        source_uri = f"file:{quote(os.path.abspath(db_path))}?mode=ro"
+        with closing(sqlite3.connect(source_uri, uri=True)) as source:
+            catalog = SchemaCatalog.build(source)
+        with closing(sqlite3.connect(f"file:{quote(tmp_path)}", uri=True)) as index:
+            index.execute("ATTACH DATABASE ? AS src", (source_uri,))
+            index.execute("CREATE TABLE search_meta (key TEXT PRIMARY KEY, value TEXT)")
+            index.execute("CREATE TABLE search_columns (table_name TEXT, column_name TEXT, fts_table TEXT)")
+            for table in catalog.tables:
+                try:
+                    index.execute(f"SELECT rowid FROM src.{quote_identifier(table)} LIMIT 1")
+                except sqlite3.OperationalError:
+                    continue  # WITHOUT ROWID table: nothing to join the index back on
+                for column in catalog.text_columns(table):
+                    fts_table = f"fts_{len(catalog.search_tables)}"
+                    catalog.search_tables[(table, column)] = fts_table
+                    index.execute(f"CREATE VIRTUAL TABLE {fts_table} USING fts5(value, tokenize='trigram')")
+                    index.execute(
+                        f"INSERT INTO {fts_table} (rowid, value) SELECT rowid, {quote_identifier(column)} "
+                        f"FROM src.{quote_identifier(table)} WHERE {quote_identifier(column)} IS NOT NULL"
+                    )
+                    index.execute("INSERT INTO search_columns VALUES (?, ?, ?)", (table, column, fts_table))
+            index.execute("INSERT INTO search_meta VALUES ('source', ?)", (stamp,))
+            index.commit()
+            index.execute("DETACH DATABASE src")
+        os.replace(tmp_path, index_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return True
+
+
+def validate_query_target(catalog, table_name, column_name):
+    """
+    Check a model-supplied table/column pair against the catalog.
+    Returns (table, column, error) with the names as stored in the schema.
+    """
+    table = catalog.resolve_table(table_name)
+    if table is None:
+        return None, None, f"The table '{table_name}' does not exist in the database."
+    column = catalog.resolve_column(table, column_name)
+    if column is None:
+        return None, None, f"The column '{column_name}' does not exist in the table '{table_name}'."
+    return table, column, None
+
+
+@timed("db.query")
 def execute_dynamic_query(conn, table_name, column_name, search_value, exact_match=False):
     """
     Executes a dynamic SQL query to search for a value in a specified column of a specified table.
@@ -33,28 +576,24 @@ def execute_dynamic_query(conn, table_name, column_name, search_value, exact_mat
     try:
         cursor = conn.cursor()
 
-        # Ensure that the table and column exist in the database schema
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name=?", (table_name,))
-        table_exists = cursor.fetchone()
-        if not table_exists:
-            return None, f"The table '{table_name}' does not exist in the database."
-
-        cursor.execute(f"PRAGMA table_info({table_name})")
-        columns = [col[1] for col in cursor.fetchall()]
-        if column_name not in columns:
-            return None, f"The column '{column_name}' does not exist in the table '{table_name}'."
+        # Ensure that the table and column exist in the database schema (cached catalog)
+        catalog = get_schema_catalog(conn)
+        table, column, error = validate_query_target(catalog, table_name, column_name)
+        if error:
+            return None, error
 
-        # Choose between LIKE or = based on exact_match
-        if exact_match:
-            query = f"SELECT * FROM {table_name} WHERE {column_name} = ?"
-        else:
-            query = f"SELECT * FROM {table_name} WHERE {column_name} LIKE ?"
+        # Choose between = and a substring match (full-text index or LIKE) based on exact_match
+        mode, condition, params = lookup_filter(catalog, table, column, search_value, exact_match)
+        query = f"SELECT * FROM {quote_identifier(table)} WHERE {condition}"
 
         # Use parameterized query to prevent SQL injection
-        cursor.execute(query, ('%' + search_value + '%',) if not exact_match else (search_value,))
+        started = time.perf_counter()
+        cursor.execute(query, params)
         
         # Fetch all rows
         results = cursor.fetchall()
+        query_stats.record(table, column, mode, catalog.uses_index(conn, query, params, table),
+                           time.perf_counter() - started, query, params)
 
         # Check if no results were found
         if len(results) == 0:
@@ -81,3 +620,68 @@ def execute_dynamic_query(conn, table_name, column_name, search_value, exact_mat
     except Exception as e:
         print(f"Unexpected error: {e}")
         return None, "An unexpected error occurred."
+
+
+@contextmanager
+def query_deadline(conn, timeout):
+    """Interrupt any statement run on `conn` inside this block once `timeout` seconds have passed."""
+    deadline = time.monotonic() + timeout
+    # A non-zero return from the progress handler aborts the running statement
+    conn.set_progress_handler(lambda: time.monotonic() > deadline, PROGRESS_HANDLER_OPS)
+    try:
+        yield
+    finally:
+        conn.set_progress_handler(None, 0)
+
+
+@timed("db.query")
+def fetch_query_page(conn, table_name, column_name, search_value, exact_match=False,
+                     after_rowid=None, page_size=PAGE_SIZE, timeout=QUERY_TIMEOUT):
+    """
+    Fetch one page of rows matching `search_value`, using keyset pagination on rowid so later
+    pages don't rescan earlier ones and no connection has to be held between pages.
+
+    The query is interrupted after `timeout` seconds (None disables the limit).
+
+    Returns a tuple (page, error) where page is a dict with keys
+    'columns', 'rows', 'last_rowid' (pass back as `after_rowid` for the next page) and 'has_more'.
+    """
+    try:
+        catalog = get_schema_catalog(conn)
+        table, column, error = validate_query_target(catalog, table_name, column_name)
+        if error:
+            return None, error
+
+        mode, condition, params = lookup_filter(catalog, table, column, search_value, exact_match)
+        if after_rowid is not None:
+            condition += " AND rowid > ?"
+            params += (after_rowid,)
+        # The page size is bound too, so every lookup of the same shape reuses one prepared statement
+        query = f"SELECT rowid, * FROM {quote_identifier(table)} WHERE {condition} ORDER BY rowid LIMIT ?"
+        params += (int(page_size) + 1,)
+
+        cursor = conn.cursor()
+        started = time.perf_counter()
+        with query_deadline(conn, timeout) if timeout else nullcontext():
+            cursor.execute(query, params)
+            # One extra row tells us whether another page exists without counting the matches
+            rows = cursor.fetchmany(page_size + 1)
+        query_stats.record(table, column, mode, catalog.uses_index(conn, query, params, table),
+                           time.perf_counter() - started, query, params)
+        has_more = len(rows) > page_size
+        rows = rows[:page_size]
+        return {
+            "columns": [desc[0] for desc in cursor.description[1:]],
+            "rows": [row[1:] for row in rows],
+            "last_rowid": rows[-1][0] if rows else after_rowid,
+            "has_more": has_more,
+        }, None
+
+    except sqlite3.OperationalError as e:
+        if "interrupted" in str(e):
+            return None, f"The lookup in the table '{table_name}' took longer than {timeout}s and was stopped."
+        print(f"SQLite error: {e}")
+        return None, f"An error occurred while querying the table '{table_name}'."
+    except sqlite3.Error as e:
+        print(f"SQLite error: {e}")
+        return None, f"An error occurred while querying the table '{table_name}'."
@@ -1,90 +1,794 @@
 import pandas as pd
-import PyPDF2
-import docx
-from PIL import Image
+import numpy as np
+import math
 import io
-from pdf2image import convert_from_path
-import fitz  # PyMuPDF
+import os
+import hashlib
+import tempfile
+import threading
+import pickle
+import json
+import shutil
+import sqlite3
+import time
+import weakref
+from urllib.parse import quote
+from collections import OrderedDict
+import multiprocessing
+from jobs import get_executor
+from metrics import timed
 
-def handle_uploaded_file(uploaded_file):
-    data = None
-    columns = []
+# PDF ingestion settings
+PDF_RENDER_DPI = 110  # Resolution of page images, rendered only when a page image is requested
+PDF_PAGES_PER_TASK = 25  # Pages handled by one worker task
+PDF_PARALLEL_MIN_PAGES = 50  # Below this, process start-up costs more than it saves
 
-    if uploaded_file is not None:
-        # Handle CSV file content
-        if uploaded_file.type == "text/csv":
-            df = pd.read_csv(uploaded_file)
-            data = df
-            columns = df.columns.tolist()
+# Bump whenever parsing output changes, so cached artifacts from older parsers are not reused
+PARSER_VERSION = 1
 
-        # Handle Excel file content
-        elif uploaded_file.type == "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet":
-            df = pd.read_excel(uploaded_file)
-            data = df
-            columns = df.columns.tolist()
-
-        # Handle TXT file content
-        elif uploaded_file.type == "text/plain":
-            text_content = uploaded_file.getvalue().decode("utf-8")
-            data = text_content  # Directly return the text content
-
-        # Handle PDF file content (text extraction with PyPDF2)
-        elif uploaded_file.type == "application/pdf":
-            pdf_file = PyPDF2.PdfReader(uploaded_file)
-            pdf_text = ""
-            for page in pdf_file.pages:
-                pdf_text += page.extract_text()
-            data = {"text": pdf_text}  # Store text in a dictionary
-
-            # Extract images from PDF pages using pdf2image
-            images = convert_from_path(uploaded_file)
-            img_files = []
-            for idx, img in enumerate(images):
-                # Save each image (optional, you can also process them here)
-                img_path = f"page_{idx + 1}.jpg"
-                img.save(img_path, 'JPEG')
-                img_files.append(img_path)
-            data["page_images"] = img_files  # Store the page images in the dictionary
-
-            # Optionally, extract embedded images from PDF using PyMuPDF
-            embedded_images = extract_images_from_pdf(uploaded_file)
-            data["embedded_images"] = embedded_images  # Store embedded images
-
-        # Handle DOCX file content
-        elif uploaded_file.type == "application/vnd.openxmlformats-officedocument.wordprocessingml.document":
-            docx_file = io.BytesIO(uploaded_file.getvalue())
-            doc = docx.Document(docx_file)
-            doc_text = ""
-            for para in doc.paragraphs:
-                doc_text += para.text + "\n"
-            data = doc_text  # Directly return the extracted text
-
-        # Handle image files
-        elif uploaded_file.type in ["image/jpeg", "image/png"]:
-            img = Image.open(uploaded_file)
-            img = img.convert('L')
-            df = pd.DataFrame(img.getdata(), columns=['pixel'])
-            data = df.iloc[:, 0]  # Just return pixel data if necessary, or analyze image as needed
+# Parsed-upload cache settings
+UPLOAD_CACHE_MAX_BYTES = 512 * 1024 * 1024  # Memory budget for parsed artifacts
+UPLOAD_CACHE_MAX_DISK_BYTES = 8 * 1024 ** 3  # Disk budget for the files cached artifacts read from
+UPLOAD_WORK_DIR = os.path.join(tempfile.gettempdir(), "chatbot-uploads")  # Those files: stored PDFs, staged tables
 
-        else:
-            raise ValueError("Unsupported file type")
+# Tabular loading settings
+LARGE_FILE_BYTES = 100 * 1024 * 1024  # Uploads above this are read in chunks and staged to disk
+CHUNK_ROWS = 100_000  # Rows read per chunk when staging
+CATEGORY_MAX_RATIO = 0.5  # Strings become categoricals when at most this share of values is unique
+
+# Image analysis settings
+IMAGE_MAX_PIXELS = 4_000_000  # Larger images are downsampled before analysis
+IMAGE_STRIP_ROWS = 512  # Rows processed at a time, bounding the size of temporaries
+LUMINANCE_WEIGHTS = np.array([19595, 38470, 7471], dtype=np.uint32)  # ITU-R 601-2 in 16.16 fixed point, as PIL's convert('L')
+
+@timed("upload.handle")
+def handle_uploaded_file(uploaded_file, cache_dir=None, cache=None):
+    """
+    Parse an uploaded file. Returns (data, columns); columns is empty for non-tabular files.
+    `cache_dir` is where derived files (e.g. PDF page images) are kept; a temp dir is used if omitted.
+    With a ParsedUploadCache, a file that was parsed before is returned without parsing it again.
+    """
+    if uploaded_file is None or cache is None:
+        return _parse_uploaded_file(uploaded_file, cache_dir)
 
+    key = cache.key_for(uploaded_file)
+    parsed = cache.get(key, cache_dir=cache_dir)
+    if parsed is None:
+        parsed = _parse_uploaded_file(uploaded_file, cache_dir)
+        cache.put(key, parsed)
+    return parsed
+
+
+def bind_cache_dir(parsed, cache_dir):
+    """
+    Return a parsed upload whose derived files (PDF page images) go to `cache_dir`, e.g. the current
+    session's. Cached artifacts are shared by every session, so this is applied each time one is fetched.
+    """
+    data, columns = parsed
+    if cache_dir and isinstance(data, dict) and isinstance(data.get("page_images"), PdfPageImages):
+        data = {**data, "page_images": data["page_images"].with_cache_dir(cache_dir)}
     return data, columns
 
 
-def extract_images_from_pdf(pdf_file):
-    """Extract embedded images from a PDF using PyMuPDF."""
-    doc = fitz.open(pdf_file)
-    image_list = []
-    
-    for page_num in range(doc.page_count):
-        page = doc.load_page(page_num)
-        img_list = page.get_images(full=True)
-        
-        for img_index, img in enumerate(img_list):
-            xref = img[0]
-            base_image = doc.extract_image(xref)
-            image_data = base_image["image"]  # This is a byte stream of the image
-            image_list.append(image_data)  # You can process or save this image
-            
-    return image_list
+class _UploadedBytes(io.BytesIO):
+    """The parts of Streamlit's UploadedFile the parsers use, rebuilt from its bytes in a worker process."""
+
+    def __init__(self, content, name, mime_type):
+        super().__init__(content)
+        self.name = name
+        self.type = mime_type
+        self.size = len(content)
+
+
+def parse_upload_bytes(content, name, mime_type, cache_dir=None):
+    """
+    Parse an upload given as bytes, as a background job (jobs.JobExecutor); module-level and picklable
+    so it can run in a worker process. Returns ((data, columns), seconds): metrics recorded in a worker
+    process never reach the app, so the parse time is sent back for the caller to record.
+    """
+    started = time.perf_counter()
+    parsed = _parse(_UploadedBytes(content, name, mime_type), cache_dir)
+    return parsed, time.perf_counter() - started
+
+
+def parse_job_kind(uploaded_file):
+    """The jobs.JobExecutor pool an upload should be parsed in: "process", or "thread" for parsers that fan out themselves."""
+    parser = get_parser(uploaded_file)
+    return getattr(parser, "job_kind", "process")
+
+
+@timed("upload.parse")
+def _parse_uploaded_file(uploaded_file, cache_dir):
+    return _parse(uploaded_file, cache_dir)
+
+
+def _parse(uploaded_file, cache_dir):
+    if uploaded_file is None:
+        return None, []
+    parser = get_parser(uploaded_file)
+    if parser is None:
+        raise ValueError("Unsupported file type")
+    return parser(uploaded_file, cache_dir)
+
+
+# Upload parsers, looked up by MIME type and then by file extension. Each parser imports its
+# library (python-docx, Pillow, PyMuPDF, openpyxl) when it first runs, so importing this module
+# stays cheap for sessions that never upload that kind of file.
+_parsers_by_type = {}
+_parsers_by_extension = {}
+
+# MIME types browsers send for more than one format (Windows sends .csv files as
+# application/vnd.ms-excel); for these the file extension decides
+GENERIC_MIME_TYPES = frozenset(["application/octet-stream", "application/vnd.ms-excel", "text/plain"])
+
+
+def register_parser(mime_types, extensions, job_kind="process"):
+    """
+    Register `parser(uploaded_file, cache_dir) -> (data, columns)` for the given MIME types and extensions.
+    `job_kind` is the pool a background parse runs in (see parse_job_kind).
+    """
+    def decorator(parser):
+        parser.job_kind = job_kind
+        for mime_type in mime_types:
+            _parsers_by_type[mime_type] = parser
+        for extension in extensions:
+            _parsers_by_extension[extension] = parser
+        return parser
+    return decorator
+
+
+def get_parser(uploaded_file):
+    """
+    Return the parser for an upload, by its MIME type or else its extension; None if unsupported.
+    The extension wins over a GENERIC_MIME_TYPES type it disagrees with.
+    """
+    mime_type = getattr(uploaded_file, "type", None)
+    extension = os.path.splitext(getattr(uploaded_file, "name", ""))[1].lstrip(".").lower()
+    by_extension = _parsers_by_extension.get(extension)
+    if by_extension is not None and mime_type in GENERIC_MIME_TYPES:
+        return by_extension
+    return _parsers_by_type.get(mime_type) or by_extension
+
+
+def supported_extensions():
+    """File extensions with a registered parser (e.g. for the uploader's `type` list)."""
+    return sorted(_parsers_by_extension)
+
+
+# Handle CSV file content (large files are staged out of core, in UPLOAD_WORK_DIR: the parsed
+# artifact is shared by every session, so it can't live in the parsing session's cache_dir)
+@register_parser(["text/csv"], ["csv"])
+def _parse_csv(uploaded_file, cache_dir):
+    data = load_tabular_upload(uploaded_file, "csv")
+    return data, list(data.columns)
+
+
+# Handle Excel file content (.xlsx only: legacy .xls workbooks need xlrd, which isn't a dependency)
+@register_parser(["application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"], ["xlsx"])
+def _parse_excel(uploaded_file, cache_dir):
+    data = load_tabular_upload(uploaded_file, "excel")
+    return data, list(data.columns)
+
+
+# Handle JSON and JSON Lines content
+@register_parser(["application/json"], ["json"])
+def _parse_json(uploaded_file, cache_dir):
+    data = load_tabular_upload(uploaded_file, "json")
+    return data, list(data.columns)
+
+
+# Handle TXT file content
+@register_parser(["text/plain"], ["txt"])
+def _parse_text(uploaded_file, cache_dir):
+    return uploaded_file.getvalue().decode("utf-8"), []  # Directly return the text content
+
+
+# Handle PDF file content (single PyMuPDF pass; page images rendered on demand).
+# Parsed in a thread job: the pages are spread over the process pool by iter_pdf_pages, which a
+# parse already running in a worker process couldn't do.
+@register_parser(["application/pdf"], ["pdf"], job_kind="thread")
+def _parse_pdf(uploaded_file, cache_dir):
+    return extract_pdf(uploaded_file.getvalue(), cache_dir or tempfile.mkdtemp(prefix="chatbot-")), []
+
+
+# Handle DOCX file content
+@register_parser(["application/vnd.openxmlformats-officedocument.wordprocessingml.document"], ["docx"])
+def _parse_docx(uploaded_file, cache_dir):
+    import docx
+
+    doc = docx.Document(io.BytesIO(uploaded_file.getvalue()))
+    return "".join(para.text + "\n" for para in doc.paragraphs), []  # Directly return the extracted text
+
+
+# Handle image files
+@register_parser(["image/jpeg", "image/png"], ["jpg", "jpeg", "png"])
+def _parse_image(uploaded_file, cache_dir):
+    # Histogram per intensity level; feeds the pie/bar chart path like any other table
+    data = image_statistics(load_image_array(uploaded_file))
+    return data, data.columns.tolist()
+
+
+def _scan_page_range(pdf_path, start, end):
+    """Return the text and embedded image xrefs of pages [start, end). Runs in a worker process."""
+    import pymupdf
+
+    texts = []
+    xrefs = []
+    with pymupdf.open(pdf_path) as doc:
+        for page_num in range(start, end):
+            page = doc.load_page(page_num)
+            texts.append(page.get_text())
+            xrefs.extend(img[0] for img in page.get_images(full=True))
+    return texts, xrefs
+
+
+def iter_pdf_pages(pdf_path, page_count):
+    """
+    Yield (text, image_xrefs) per batch of pages, in page order.
+    Large documents are spread across a process pool.
+    """
+    ranges = [(start, min(start + PDF_PAGES_PER_TASK, page_count))
+              for start in range(0, page_count, PDF_PAGES_PER_TASK)]
+    executor = get_executor()
+    # A parse already running in a worker process can't start a pool of its own (PDFs are parsed in thread jobs)
+    if (page_count < PDF_PARALLEL_MIN_PAGES or executor.process_workers < 2
+            or multiprocessing.parent_process() is not None):
+        for start, end in ranges:
+            yield _scan_page_range(pdf_path, start, end)
+    else:
+        pool = executor.process_pool
+        yield from pool.map(_scan_page_range, *zip(*[(pdf_path, start, end) for start, end in ranges]))
+
+
+def extract_pdf(pdf_bytes, cache_dir, dpi=PDF_RENDER_DPI, work_dir=UPLOAD_WORK_DIR):
+    """
+    Extract a PDF's text in one pass and return a dict with:
+      text: the text of every page
+      page_images: lazily rendered page images (PdfPageImages), kept in `cache_dir`
+      embedded_images: lazily extracted embedded images (PdfEmbeddedImages)
+    The PDF is stored in `work_dir` and deleted once neither handle refers to it any more.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    pdf_file = _WorkingFile.create(work_dir, ".pdf")
+    pdf_path = pdf_file.path
+    with open(pdf_path, "wb") as f:
+        f.write(pdf_bytes)
+
+    import pymupdf
+
+    with pymupdf.open(pdf_path) as doc:
+        page_count = doc.page_count
+
+    texts = []
+    xrefs = []
+    for page_texts, page_xrefs in iter_pdf_pages(pdf_path, page_count):
+        texts.extend(page_texts)
+        xrefs.extend(page_xrefs)
+
+    return {
+        "text": "".join(texts),
+        "page_images": PdfPageImages(pdf_file, page_count, cache_dir, dpi=dpi),
+        # An image shown on several pages is only listed once
+        "embedded_images": PdfEmbeddedImages(pdf_file, list(dict.fromkeys(xrefs))),
+    }
+
+
+def _remove_file(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+class _WorkingFile:
+    """
+    A file created while parsing an upload, deleted once no parsed artifact refers to it any more.
+    Pickling hands the file over to the unpickled copy (e.g. a result returned from a worker process).
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._finalizer = weakref.finalize(self, _remove_file, path)
+
+    @classmethod
+    def create(cls, directory, suffix):
+        os.makedirs(directory, exist_ok=True)
+        fd, path = tempfile.mkstemp(dir=directory, suffix=suffix)
+        os.close(fd)
+        return cls(path)
+
+    def remove(self):
+        self._finalizer()
+
+    def __getstate__(self):
+        self._finalizer.detach()
+        return self.path
+
+    def __setstate__(self, path):
+        self.__init__(path)
+
+
+class PdfPageImages:
+    """
+    Page images of a PDF, rasterized on first access and cached as PNG files.
+    Indexing returns the path of the page image.
+    """
+
+    def __init__(self, pdf_file, page_count, cache_dir, dpi=PDF_RENDER_DPI):
+        self._pdf_file = pdf_file
+        self.pdf_path = pdf_file.path
+        self.page_count = page_count
+        self.cache_dir = cache_dir
+        self.dpi = dpi
+
+    def with_cache_dir(self, cache_dir):
+        """The same pages, rendered into (and read from) `cache_dir`."""
+        if cache_dir == self.cache_dir:
+            return self
+        os.makedirs(cache_dir, exist_ok=True)
+        return PdfPageImages(self._pdf_file, self.page_count, cache_dir, dpi=self.dpi)
+
+    def __len__(self):
+        return self.page_count
+
+    def __getitem__(self, index):
+        if not -self.page_count <= index < self.page_count:
+            raise IndexError("page index out of range")
+        index %= self.page_count
+        stem = os.path.splitext(os.path.basename(self.pdf_path))[0]
+        img_path = os.path.join(self.cache_dir, f"{stem}_page_{index + 1}_{self.dpi}dpi.png")
+        if not os.path.exists(img_path):
+            import pymupdf
+
+            with pymupdf.open(self.pdf_path) as doc:
+                doc.load_page(index).get_pixmap(dpi=self.dpi).save(img_path)
+        return img_path
+
+    def __iter__(self):
+        return (self[i] for i in range(self.page_count))
+
+
+class PdfEmbeddedImages:
+    """Embedded images of a PDF, extracted as raw image bytes on first access."""
+
+    def __init__(self, pdf_file, xrefs):
+        self._pdf_file = pdf_file
+        self.pdf_path = pdf_file.path
+        self.xrefs = xrefs
+        self._cache = {}
+
+    def __len__(self):
+        return len(self.xrefs)
+
+    def __getitem__(self, index):
+        xref = self.xrefs[index]
+        if xref not in self._cache:
+            import pymupdf
+
+            with pymupdf.open(self.pdf_path) as doc:
+                self._cache[xref] = doc.extract_image(xref)["image"]  # This is a byte stream of the image
+        return self._cache[xref]
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self.xrefs)))
+
+
+def load_image_array(image_file, max_pixels=IMAGE_MAX_PIXELS):
+    """
+    Decode an image into a uint8 NumPy array of shape (height, width, 3), downsampled so it has
+    at most about `max_pixels` pixels. JPEGs are downscaled while decoding, which is much cheaper.
+    """
+    from PIL import Image
+
+    img = Image.open(image_file)
+    width, height = img.size
+    if max_pixels and width * height > max_pixels:
+        factor = math.ceil(math.sqrt(width * height / max_pixels))
+        img.draft("RGB", (width // factor, height // factor))  # No-op for formats other than JPEG
+        width, height = img.size
+        factor = math.ceil(math.sqrt(width * height / max_pixels))
+        if factor > 1:
+            # reduce() rejects some modes (1, I;16) and would average palette indices (P, PA):
+            # convert those first, grayscale ones to L (a third of the size of RGB)
+            if img.mode not in ("L", "RGB", "RGBA"):
+                img = img.convert("L" if Image.getmodebase(img.mode) == "L" else "RGB")
+            img = img.reduce(factor)
+    return np.asarray(img.convert("RGB"))
+
+
+def iter_image_strips(array, rows=IMAGE_STRIP_ROWS):
+    """Yield views of consecutive horizontal strips of an image array (no copies)."""
+    for top in range(0, array.shape[0], rows):
+        yield array[top:top + rows]
+
+
+def image_statistics(array):
+    """
+    Compute intensity histograms of an RGB image array, strip by strip with vectorized bincounts.
+
+    Returns a DataFrame with one row per intensity level (0-255) and the pixel counts of the
+    gray (luminance), red, green and blue channels. Per-channel mean/std/min/max are stored in
+    `df.attrs["channel_stats"]`.
+    """
+    counts = {name: np.zeros(256, dtype=np.int64) for name in ("gray", "red", "green", "blue")}
+    for strip in iter_image_strips(array):
+        pixels = strip.reshape(-1, 3)
+        # Integer luminance, rounded the same way as PIL's convert('L')
+        gray = ((pixels @ LUMINANCE_WEIGHTS + 0x8000) >> 16).astype(np.uint8)
+        for name, channel in zip(counts, (gray, pixels[:, 0], pixels[:, 1], pixels[:, 2])):
+            counts[name] += np.bincount(channel, minlength=256)
+
+    levels = np.arange(256)
+    total = max(array.shape[0] * array.shape[1], 1)
+    channel_stats = {}
+    for name, hist in counts.items():
+        mean = float(hist @ levels) / total
+        nonzero = np.flatnonzero(hist)
+        channel_stats[name] = {
+            "mean": mean,
+            "std": math.sqrt(max(float(hist @ (levels ** 2)) / total - mean ** 2, 0.0)),
+            "min": int(nonzero[0]) if nonzero.size else 0,
+            "max": int(nonzero[-1]) if nonzero.size else 0,
+        }
+
+    df = pd.DataFrame({"intensity": levels, **counts})
+    df.attrs["channel_stats"] = channel_stats
+    df.attrs["shape"] = tuple(array.shape)
+    return df
+
+
+def _artifact_disk_size(value):
+    """Size of the working files a parsed artifact reads from, in bytes."""
+    data, _ = value
+    if isinstance(data, StagedTable):
+        paths = [data.path]
+    elif _holds_working_files(data):
+        paths = {handle.pdf_path for handle in data.values() if isinstance(handle, (PdfPageImages, PdfEmbeddedImages))}
+    else:
+        return 0
+    return sum(os.path.getsize(path) for path in paths if os.path.exists(path))
+
+
+def _artifact_size(value):
+    """Approximate in-memory size of a parsed artifact, in bytes."""
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(deep=True).sum())
+    if isinstance(value, pd.Series):
+        return int(value.memory_usage(deep=True))
+    if isinstance(value, (str, bytes)):
+        return len(value)
+    if isinstance(value, dict):
+        return sum(_artifact_size(v) for v in value.values())
+    if isinstance(value, (tuple, list)):
+        return sum(_artifact_size(v) for v in value)
+    return 64  # Lazy handles (page images etc.) only hold a few paths
+
+
+def _holds_working_files(data):
+    # Artifacts that read from working files (see _WorkingFile) rather than holding their data
+    if isinstance(data, StagedTable):
+        return True
+    return isinstance(data, dict) and any(isinstance(value, (PdfPageImages, PdfEmbeddedImages))
+                                          for value in data.values())
+
+
+class ParsedUploadCache:
+    """
+    LRU cache of parsed uploads keyed by a hash of the file bytes, the file type and PARSER_VERSION.
+
+    Entries are kept in memory up to `max_bytes`, and the files they read from (staged tables,
+    stored PDFs) up to `max_disk_bytes`; an evicted entry's files are deleted once no session uses it. When `spill_dir` is set, evicted entries are
+    written to a directory of this cache's own inside it (DataFrames as Parquet when pyarrow is
+    available, anything else pickled) and loaded back on the next hit instead of being parsed again.
+    A spill file is deleted once loaded back, and the directory when the cache is (at the latest at exit).
+    Entries are shared by every session; pass `cache_dir` to get() for the session's derived files.
+    """
+
+    def __init__(self, max_bytes=UPLOAD_CACHE_MAX_BYTES, spill_dir=None, max_disk_bytes=UPLOAD_CACHE_MAX_DISK_BYTES):
+        self.max_bytes = max_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self.spill_dir = None
+        self.hits = 0
+        self.misses = 0
+        self.spills = 0
+        self._entries = OrderedDict()  # key -> (value, size, disk_size)
+        self._size = 0
+        self._disk_size = 0
+        self._digests = {}  # Streamlit file_id -> key, so reruns don't rehash the same upload
+        self._lock = threading.Lock()
+        if spill_dir:
+            os.makedirs(spill_dir, exist_ok=True)
+            self.spill_dir = tempfile.mkdtemp(dir=spill_dir, prefix="spill-")
+            weakref.finalize(self, shutil.rmtree, self.spill_dir, ignore_errors=True)
+
+    def key_for(self, uploaded_file):
+        file_id = getattr(uploaded_file, "file_id", None)
+        if file_id is not None and file_id in self._digests:
+            return self._digests[file_id]
+        digest = hashlib.sha256(uploaded_file.getvalue()).hexdigest()
+        key = f"{digest}-{hashlib.sha1(uploaded_file.type.encode()).hexdigest()[:8]}-v{PARSER_VERSION}"
+        if file_id is not None:
+            if len(self._digests) >= 1024:
+                self._digests.clear()  # Only recent uploads matter; keep the map bounded
+            self._digests[file_id] = key
+        return key
+
+    def get(self, key, cache_dir=None):
+        """Return the parsed upload for `key` (see bind_cache_dir for `cache_dir`), or None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return bind_cache_dir(entry[0], cache_dir)
+        value = self._load_spilled(key)
+        if value is None:
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        self.put(key, value)
+        return bind_cache_dir(value, cache_dir)
+
+    def put(self, key, value):
+        size = _artifact_size(value)
+        disk_size = _artifact_disk_size(value)
+        evicted = []
+        with self._lock:
+            if key in self._entries:
+                _, old_size, old_disk_size = self._entries.pop(key)
+                self._size -= old_size
+                self._disk_size -= old_disk_size
+            self._entries[key] = (value, size, disk_size)
+            self._size += size
+            self._disk_size += disk_size
+            # Evict least recently used entries, but never the one just added
+            while ((self._size > self.max_bytes or self._disk_size > self.max_disk_bytes)
+                   and len(self._entries) > 1):
+                old_key, (old_value, old_size, old_disk_size) = self._entries.popitem(last=False)
+                self._size -= old_size
+                self._disk_size -= old_disk_size
+                evicted.append((old_key, old_value))
+        for old_key, old_value in evicted:
+            self._spill(old_key, old_value)
+
+    def _spill_path(self, key, extension):
+        return os.path.join(self.spill_dir, f"{key}.{extension}")
+
+    def _spill(self, key, value):
+        if not self.spill_dir:
+            return
+        data, columns = value
+        if _holds_working_files(data):
+            return  # Its data is on disk already; dropping the entry lets the files be deleted
+        if isinstance(data, pd.DataFrame):
+            try:
+                data.to_parquet(self._spill_path(key, "parquet"))
+                self.spills += 1
+                return
+            except (ImportError, ValueError, TypeError):
+                pass  # No pyarrow, or columns Parquet can't store: pickle instead
+        with open(self._spill_path(key, "pkl"), "wb") as f:
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        self.spills += 1
+
+    def _load_spilled(self, key):
+        if not self.spill_dir:
+            return None
+        # Back in memory, the entry is spilled again if it's evicted again
+        parquet_path = self._spill_path(key, "parquet")
+        if os.path.exists(parquet_path):
+            data = pd.read_parquet(parquet_path)
+            _remove_file(parquet_path)
+            return data, data.columns.tolist()
+        pickle_path = self._spill_path(key, "pkl")
+        if os.path.exists(pickle_path):
+            with open(pickle_path, "rb") as f:
+                value = pickle.load(f)
+            _remove_file(pickle_path)
+            return value
+        return None
+
+    def clear(self):
+        """Drop every entry, in memory and spilled."""
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+            self._disk_size = 0
+        if self.spill_dir:
+            for name in os.listdir(self.spill_dir):
+                _remove_file(os.path.join(self.spill_dir, name))
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "bytes": self._size, "max_bytes": self.max_bytes,
+                    "disk_bytes": self._disk_size,
+                    "hits": self.hits, "misses": self.misses, "spills": self.spills}
+
+
+def optimize_dtypes(df):
+    """
+    Shrink a DataFrame in place: downcast integers, downcast floats when no precision is lost,
+    and store repeated strings as categoricals.
+    """
+    for column in df.columns:
+        series = df[column]
+        if pd.api.types.is_bool_dtype(series.dtype):
+            continue
+        if pd.api.types.is_integer_dtype(series.dtype):
+            df[column] = pd.to_numeric(series, downcast="integer")
+        elif pd.api.types.is_float_dtype(series.dtype):
+            downcast = pd.to_numeric(series, downcast="float")
+            if downcast.dtype != series.dtype and downcast.astype(series.dtype).equals(series):
+                df[column] = downcast
+        elif series.dtype == object or pd.api.types.is_string_dtype(series.dtype):
+            if len(series) and series.nunique(dropna=True) <= CATEGORY_MAX_RATIO * len(series):
+                df[column] = series.astype("category")
+    return df
+
+
+def _upload_size(uploaded_file):
+    size = getattr(uploaded_file, "size", None)
+    return size if size is not None else len(uploaded_file.getvalue())
+
+
+def _iter_excel_chunks(uploaded_file, chunk_rows=CHUNK_ROWS):
+    # openpyxl's read-only mode streams rows instead of loading the whole workbook
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(io.BytesIO(uploaded_file.getvalue()), read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = [str(name) if name is not None else f"Unnamed: {i}" for i, name in enumerate(next(rows, ()))]
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= chunk_rows:
+                yield pd.DataFrame(batch, columns=header)
+                batch = []
+        if batch or not header:
+            yield pd.DataFrame(batch, columns=header)
+    finally:
+        workbook.close()
+
+
+def _is_json_lines(uploaded_file):
+    """True for JSON Lines (a complete record on the first line, more after it) rather than one JSON document."""
+    uploaded_file.seek(0)
+    try:
+        first_line = uploaded_file.readline()
+        while first_line and not first_line.strip():
+            first_line = uploaded_file.readline()
+        if first_line.lstrip().startswith(b"["):
+            return False
+        try:
+            json.loads(first_line)
+        except ValueError:
+            return False  # A document spread over several lines
+        return bool(uploaded_file.read(1024).strip())
+    finally:
+        uploaded_file.seek(0)
+
+
+def _iter_json_chunks(uploaded_file, chunk_rows=CHUNK_ROWS):
+    if not _is_json_lines(uploaded_file):
+        # A JSON document can't be read incrementally with pandas; load it once and stage it in slices
+        df = pd.read_json(uploaded_file)
+        for start in range(0, len(df), chunk_rows):
+            yield df.iloc[start:start + chunk_rows]
+        return
+    # JSON Lines: one record per line, read in chunks
+    with pd.read_json(uploaded_file, lines=True, chunksize=chunk_rows) as reader:
+        yield from reader
+
+
+def load_tabular_upload(uploaded_file, kind, staging_dir=None, large_file_bytes=LARGE_FILE_BYTES):
+    """
+    Load a CSV ("csv"), Excel ("excel") or JSON ("json") upload.
+
+    Files up to `large_file_bytes` are read into a DataFrame with compact dtypes. Larger files are
+    read in chunks and staged into a SQLite file, returned as a StagedTable that previews and
+    charts read slices from without ever loading the full frame.
+    """
+    if _upload_size(uploaded_file) <= large_file_bytes:
+        if kind == "csv":
+            df = pd.read_csv(uploaded_file)
+        elif kind == "excel":
+            df = pd.read_excel(uploaded_file)
+        else:
+            df = pd.read_json(uploaded_file, lines=_is_json_lines(uploaded_file))
+        return optimize_dtypes(df)
+
+    if kind == "csv":
+        chunks = pd.read_csv(uploaded_file, chunksize=CHUNK_ROWS)
+    elif kind == "excel":
+        chunks = _iter_excel_chunks(uploaded_file)
+    else:
+        chunks = _iter_json_chunks(uploaded_file)
+    return StagedTable.from_chunks(chunks, staging_dir or UPLOAD_WORK_DIR)
+
+
+class StagedTable:
+    """
+    A large tabular upload staged into a SQLite file, one row per original row (rowid = position + 1).
+    Offers the small part of the DataFrame API the previews and charts need, reading only the
+    requested rows. The file is deleted once nothing refers to the table any more.
+    """
+
+    TABLE = "data"
+
+    def __init__(self, staged_file, columns, row_count):
+        self._staged_file = staged_file
+        self.path = staged_file.path
+        self.columns = columns
+        self.row_count = row_count
+
+    @classmethod
+    def from_chunks(cls, chunks, staging_dir):
+        staged_file = _WorkingFile.create(staging_dir, ".staged.db")
+        columns = None
+        row_count = 0
+        conn = sqlite3.connect(staged_file.path)
+        try:
+            conn.execute("PRAGMA journal_mode = OFF")
+            conn.execute("PRAGMA synchronous = OFF")
+            for chunk in chunks:
+                chunk = optimize_dtypes(chunk.reset_index(drop=True))
+                if columns is None:
+                    columns = [str(column) for column in chunk.columns]
+                chunk.columns = columns
+                chunk.to_sql(cls.TABLE, conn, if_exists="append", index=False)
+                row_count += len(chunk)
+            conn.commit()
+        except BaseException:
+            conn.close()
+            staged_file.remove()
+            raise
+        conn.close()
+        return cls(staged_file, columns or [], row_count)
+
+    def _query(self, sql, params=()):
+        conn = sqlite3.connect(f"file:{quote(self.path)}?mode=ro", uri=True)
+        try:
+            return pd.read_sql_query(sql, conn, params=params)
+        finally:
+            conn.close()
+
+    def __len__(self):
+        return self.row_count
+
+    @property
+    def empty(self):
+        return self.row_count == 0
+
+    def slice(self, columns, start, end):
+        """Rows [start, end) of the given columns, as a DataFrame indexed by row position."""
+        start = max(int(start), 0)
+        end = min(int(end), self.row_count)
+        selected = ", ".join('"' + column.replace('"', '""') + '"' for column in columns)
+        df = self._query(
+            f"SELECT rowid - 1 AS _position, {selected} FROM {self.TABLE} "
+            f"WHERE rowid > ? AND rowid <= ? ORDER BY rowid",
+            (start, end),
+        )
+        return optimize_dtypes(df.set_index("_position").rename_axis(None))
+
+    def column(self, column, start, end):
+        return self.slice([column], start, end)[column]
+
+    def take(self, column, positions):
+        """Values of `column` at the given row positions, in the order given."""
+        positions = [int(p) for p in positions]
+        if not positions:
+            return pd.Series([], dtype=object, name=column)
+        quoted = '"' + column.replace('"', '""') + '"'
+        df = self._query(
+            f"SELECT rowid - 1 AS _position, {quoted} FROM {self.TABLE} "
+            f"WHERE rowid IN ({', '.join('?' * len(positions))})",
+            [p + 1 for p in positions],
+        )
+        return df.set_index("_position")[column].reindex(positions)
+
+    def head(self, n=5):
+        return self.slice(self.columns, 0, n)
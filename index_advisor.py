@@ -0,0 +1,166 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+from contextlib import closing
+from urllib.parse import quote
+from database import (SEARCH_INDEX_SUFFIX, SchemaCatalog, explain_query_plan, plan_uses_index, query_stats,
+                      quote_identifier, source_stamp)
+
+# Writable copy of the database holding the indexes the advisor created
+INDEXED_COPY_SUFFIX = ".indexed.db"
+
+ADVISOR_MIN_LOOKUPS = 5  # Exact lookups a column needs before an index is worth its space
+INDEX_PREFIX = "advisor_"  # Name prefix of the indexes the advisor creates
+
+
+def _index_name(table, column):
+    return f"{INDEX_PREFIX}{table}_{column}".replace('"', '')
+
+
+def _index_sql(table, column):
+    # The rowid is part of every index entry, so an index on the column alone also serves the
+    # keyset pagination (`column = ? AND rowid > ? ORDER BY rowid`) without a sort
+    return (f"CREATE INDEX IF NOT EXISTS {quote_identifier(_index_name(table, column))} "
+            f"ON {quote_identifier(table)} ({quote_identifier(column)})")
+
+
+def _schema_replica(db_path):
+    """In-memory database with the tables and indexes of `db_path` but none of its rows."""
+    replica = sqlite3.connect(":memory:")
+    with closing(sqlite3.connect(f"file:{quote(os.path.abspath(db_path))}?mode=ro", uri=True)) as source:
+        statements = source.execute(
+            "SELECT sql FROM sqlite_master WHERE sql IS NOT NULL AND name NOT LIKE 'sqlite_%' "
+            "ORDER BY type = 'index'"  # Tables before their indexes
+        ).fetchall()
+    for (sql,) in statements:
+        try:
+            replica.execute(sql)
+        except sqlite3.Error:
+            pass  # e.g. virtual tables of a module this build lacks; not needed for B-tree plans
+    return replica
+
+
+def _current_catalog(db_path):
+    # Indexes created earlier live in the indexed copy, not in the downloaded file
+    current_path = indexed_copy(db_path) or db_path
+    with closing(sqlite3.connect(f"file:{quote(os.path.abspath(current_path))}?mode=ro", uri=True)) as conn:
+        return current_path, SchemaCatalog.build(conn)
+
+
+def recommend_indexes(db_path, stats=None, min_lookups=ADVISOR_MIN_LOOKUPS):
+    """
+    Recommend indexes for the columns hot with exact-match lookups that currently scan their table.
+
+    Each candidate is created in an empty in-memory replica of the schema and kept only if
+    EXPLAIN QUERY PLAN shows the recorded lookup then uses an index.
+    Returns a list of dicts with the table, column, lookup counters and CREATE INDEX statement.
+    """
+    stats = query_stats.snapshot() if stats is None else stats
+    current_path, catalog = _current_catalog(db_path)
+    candidates = [
+        (table, column, counters) for (table, column, mode), counters in stats.items()
+        if mode == "exact" and counters["lookups"] >= min_lookups and counters["scans"] > 0
+        and not catalog.is_indexed(table, column)
+    ]
+    if not candidates:
+        return []
+
+    recommendations = []
+    with closing(_schema_replica(current_path)) as replica:
+        for table, column, counters in sorted(candidates, key=lambda c: -c[2]["lookups"]):
+            sql = _index_sql(table, column)
+            replica.execute(sql)
+            sample_sql, sample_params = counters["sample"]
+            plan = explain_query_plan(replica, sample_sql, sample_params)
+            if plan_uses_index(plan, table):
+                recommendations.append({"table": table, "column": column, "lookups": counters["lookups"],
+                                        "scans": counters["scans"], "sql": sql, "plan": plan,
+                                        "sample": counters["sample"]})
+    return recommendations
+
+
+def create_indexes(db_path, recommendations):
+    """
+    Create the recommended indexes in a writable copy of `db_path` (next to it, INDEXED_COPY_SUFFIX)
+    and check with EXPLAIN QUERY PLAN that each recorded lookup now uses its index (sets "verified").
+    Indexes from an earlier copy are kept. The source database is never modified. Returns the path of the copy.
+    """
+    copy_path = db_path + INDEXED_COPY_SUFFIX
+    current_path = indexed_copy(db_path) or db_path
+    directory = os.path.dirname(os.path.abspath(db_path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".indexed")
+    os.close(fd)
+    try:
+        # Stamp the copy with the source it was made from, so a newer download isn't shadowed by it
+        stamp = source_stamp(db_path)
+        shutil.copyfile(current_path, tmp_path)
+        with closing(sqlite3.connect(tmp_path)) as conn:
+            for recommendation in recommendations:
+                conn.execute(recommendation["sql"])
+                # Give the planner statistics for the new index, like the ones the source has for its own
+                index_name = _index_name(recommendation["table"], recommendation["column"])
+                conn.execute(f"ANALYZE {quote_identifier(index_name)}")
+            conn.execute("CREATE TABLE IF NOT EXISTS advisor_meta (key TEXT PRIMARY KEY, value TEXT)")
+            conn.execute("INSERT OR REPLACE INTO advisor_meta VALUES ('source', ?)", (stamp,))
+            conn.commit()
+            for recommendation in recommendations:
+                sample_sql, sample_params = recommendation["sample"]
+                recommendation["plan"] = explain_query_plan(conn, sample_sql, sample_params)
+                recommendation["verified"] = plan_uses_index(recommendation["plan"], recommendation["table"])
+
+        # The copy keeps the source's rowids, so the full-text sidecar applies to it unchanged
+        search_index = db_path + SEARCH_INDEX_SUFFIX
+        if os.path.exists(search_index):
+            shutil.copyfile(search_index, copy_path + SEARCH_INDEX_SUFFIX)
+        os.replace(tmp_path, copy_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return copy_path
+
+
+def indexed_copy(db_path):
+    """Path of the advisor's indexed copy of `db_path` if one exists and was made from the current file, else None."""
+    copy_path = db_path + INDEXED_COPY_SUFFIX
+    if not os.path.exists(copy_path) or not os.path.exists(db_path):
+        return None
+    try:
+        with closing(sqlite3.connect(f"file:{quote(os.path.abspath(copy_path))}?mode=ro", uri=True)) as conn:
+            row = conn.execute("SELECT value FROM advisor_meta WHERE key = 'source'").fetchone()
+    except sqlite3.Error:
+        return None
+    return copy_path if row and row[0] == source_stamp(db_path) else None
+
+
+def advisor_report(db_path, stats=None, min_lookups=ADVISOR_MIN_LOOKUPS):
+    """
+    Summarize the recorded workload and the indexes recommended for it.
+
+    Returns a dict with:
+      lookups: one row per (table, column, mode) with its lookup, index and scan counts
+      recommendations: see recommend_indexes()
+      before / after: lookups that used an index vs. scanned, as recorded and as they would be with
+                      the indexes created so far plus the recommended ones
+    """
+    stats = query_stats.snapshot() if stats is None else stats
+    recommendations = recommend_indexes(db_path, stats, min_lookups)
+    _, catalog = _current_catalog(db_path)
+    indexed = {(r["table"], r["column"]) for r in recommendations}
+    indexed.update((table, column) for table, column, _ in stats if catalog.is_indexed(table, column))
+
+    before = {"index": 0, "scans": 0}
+    after = {"index": 0, "scans": 0}
+    lookups = []
+    for (table, column, mode), counters in sorted(stats.items()):
+        lookups.append({"table": table, "column": column, "mode": mode, "lookups": counters["lookups"],
+                        "index": counters["index"], "scans": counters["scans"],
+                        "avg_ms": counters["seconds"] / counters["lookups"] * 1000})
+        before["index"] += counters["index"]
+        before["scans"] += counters["scans"]
+        if mode == "exact" and (table, column) in indexed:
+            after["index"] += counters["lookups"]
+        else:
+            after["index"] += counters["index"]
+            after["scans"] += counters["scans"]
+    return {"lookups": lookups, "recommendations": recommendations, "before": before, "after": after}
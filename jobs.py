@@ -0,0 +1,197 @@
+import contextvars
+import multiprocessing
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import CancelledError, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+# Process-wide background job settings
+JOB_THREAD_WORKERS = 8  # I/O-bound jobs: model requests, database lookups
+JOB_PROCESS_WORKERS = os.cpu_count() or 1  # CPU-bound jobs: parsing uploads
+JOB_MAX_PENDING = 64  # Unfinished jobs per pool before new submissions are refused
+JOB_RESULT_TTL = 600  # Seconds a finished job's result is kept for reruns to collect
+# Worker processes are not forked from the multi-threaded server (a lock held by another thread at
+# fork time would deadlock them); "spawn" where forkserver isn't available
+JOB_START_METHOD = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+
+_current_job = contextvars.ContextVar("current_job", default=None)
+
+
+class JobQueueFull(RuntimeError):
+    """Raised by JobExecutor.submit when a pool already has JOB_MAX_PENDING unfinished jobs."""
+
+
+class Job:
+    """A submitted unit of work; reruns find it again by key and poll it instead of resubmitting."""
+
+    def __init__(self, key, kind):
+        self.key = key
+        self.kind = kind
+        self.future = None
+        self.submitted_at = time.time()
+        self.finished_at = None
+        self.progress = None  # Free-form partial result a thread job may publish (e.g. streamed text)
+        self._cancel_requested = threading.Event()
+
+    def done(self):
+        return self.future.done()
+
+    def wait(self, timeout=None):
+        """Wait up to `timeout` seconds for the job to finish; return whether it has."""
+        try:
+            self.future.exception(timeout)
+        except (FutureTimeoutError, CancelledError):
+            pass
+        return self.future.done()
+
+    def result(self, timeout=None):
+        return self.future.result(timeout)
+
+    def status(self):
+        if self.future.cancelled():
+            return "cancelled"
+        if not self.future.done():
+            return "running" if self.future.running() else "queued"
+        return "failed" if self.future.exception() is not None else "done"
+
+    def cancel(self):
+        """
+        Cancel the job: a queued job never starts; a running thread job sees cancel_requested()
+        return True and is expected to stop early. A running process job runs to completion.
+        """
+        self._cancel_requested.set()
+        return self.future.cancel()
+
+    @property
+    def cancel_requested(self):
+        return self._cancel_requested.is_set()
+
+
+def current_job():
+    """The Job whose function is running on this thread (thread jobs only), or None."""
+    return _current_job.get()
+
+
+def cancel_requested():
+    """True if the thread job running on this thread was cancelled; lets long calls stop early."""
+    job = _current_job.get()
+    return job is not None and job.cancel_requested
+
+
+def _run_thread_job(job, fn, args, kwargs):
+    _current_job.set(job)
+    return fn(*args, **kwargs)
+
+
+class JobExecutor:
+    """
+    Runs background jobs for every session of the process: a thread pool for I/O-bound work
+    (model requests, database lookups) and a process pool for CPU-bound parsing.
+
+    Jobs are deduplicated by key: submitting a key that is queued, running or finished (and not
+    yet collected) returns the existing job. Each pool accepts at most `max_pending` unfinished
+    jobs; beyond that submit() raises JobQueueFull, so callers can tell the user to retry
+    instead of piling up work.
+    """
+
+    def __init__(self, thread_workers=JOB_THREAD_WORKERS, process_workers=JOB_PROCESS_WORKERS,
+                 max_pending=JOB_MAX_PENDING, result_ttl=JOB_RESULT_TTL):
+        self.thread_pool = ThreadPoolExecutor(max_workers=thread_workers, thread_name_prefix="job")
+        self.process_workers = process_workers
+        self.max_pending = max_pending
+        self.result_ttl = result_ttl
+        self._process_pool = None
+        self._jobs = {}
+        self._pending = {"thread": 0, "process": 0}
+        self._lock = threading.RLock()  # Reentrant: a done callback can run inside submit()
+        self.submitted = 0
+        self.deduplicated = 0
+        self.rejected = 0
+
+    @property
+    def process_pool(self):
+        # Started on first use: worker processes are only worth their start-up cost when something is parsed
+        with self._lock:
+            if self._process_pool is None:
+                self._process_pool = ProcessPoolExecutor(max_workers=self.process_workers,
+                                                         mp_context=multiprocessing.get_context(JOB_START_METHOD))
+            return self._process_pool
+
+    def submit(self, key, fn, *args, kind="thread", **kwargs):
+        """
+        Run `fn(*args, **kwargs)` in the thread pool (kind="thread") or the process pool (kind="process")
+        and return its Job. `key` identifies the work for deduplication; None means never deduplicate.
+        Process jobs need a picklable, module-level `fn`.
+        """
+        self._expire()
+        pool = self.thread_pool if kind == "thread" else self.process_pool
+        with self._lock:
+            if key is not None:
+                job = self._jobs.get(key)
+                if job is not None and not job.cancel_requested:
+                    self.deduplicated += 1
+                    return job
+            else:
+                key = uuid.uuid4().hex
+            if self._pending[kind] >= self.max_pending:
+                self.rejected += 1
+                raise JobQueueFull(f"Too many background jobs are waiting ({self._pending[kind]}); try again shortly.")
+            job = Job(key, kind)
+            if kind == "thread":
+                # Run in a copy of the caller's context (e.g. its metrics trace), with the job made current
+                job.future = pool.submit(contextvars.copy_context().run, _run_thread_job, job, fn, args, kwargs)
+            else:
+                job.future = pool.submit(fn, *args, **kwargs)
+            self._jobs[key] = job
+            self._pending[kind] += 1
+            self.submitted += 1
+            job.future.add_done_callback(lambda _: self._finished(job))
+            return job
+
+    def _finished(self, job):
+        with self._lock:
+            job.finished_at = time.time()
+            self._pending[job.kind] -= 1
+
+    def get(self, key):
+        """Return the job submitted under `key`, or None if there is none (or it expired)."""
+        with self._lock:
+            return self._jobs.get(key)
+
+    def cancel(self, key):
+        job = self.get(key)
+        return job.cancel() if job is not None else False
+
+    def forget(self, key):
+        """Drop a job once its result has been collected."""
+        with self._lock:
+            self._jobs.pop(key, None)
+
+    def _expire(self):
+        # Results nobody came back for (e.g. the session was closed) are dropped after result_ttl
+        cutoff = time.time() - self.result_ttl
+        with self._lock:
+            for key in [key for key, job in self._jobs.items()
+                        if job.finished_at is not None and job.finished_at < cutoff]:
+                del self._jobs[key]
+
+    def stats(self):
+        with self._lock:
+            return {"jobs": len(self._jobs), "pending_threads": self._pending["thread"],
+                    "pending_processes": self._pending["process"], "submitted": self.submitted,
+                    "deduplicated": self.deduplicated, "rejected": self.rejected}
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """Return the process-wide JobExecutor, creating it on first use."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = JobExecutor()
+        return _executor
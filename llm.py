@@ -0,0 +1,290 @@
+import hashlib
+import json
+import math
+import re
+import sqlite3
+import threading
+import time
+from functools import lru_cache
+
+# Token budget for everything sent to the model (system prompt + summary + recent turns)
+CONTEXT_TOKEN_BUDGET = 6000
+SUMMARY_TOKEN_BUDGET = 600  # Part of the budget reserved for the summary of older turns
+SUMMARY_BLOCK_SIZE = 8  # Older turns are summarized in fixed blocks so earlier summaries stay cached
+SUMMARY_CHARS_PER_TURN = 160  # Length of each turn's line in the summary
+TOKENS_PER_MESSAGE = 4  # Role and formatting overhead the chat format adds to every message
+CHARS_PER_TOKEN = 4  # Rough average for English text with GPT tokenizers
+
+# On-disk cache of model responses
+RESPONSE_CACHE_DB = 'response_cache.db'
+RESPONSE_CACHE_TTL = 24 * 3600  # Seconds a cached response stays valid
+RESPONSE_CACHE_MAX_ENTRIES = 5000
+RESPONSE_CACHE_MAX_BYTES = 50 * 1024 * 1024
+
+
+def estimate_tokens(text):
+    """
+    Estimate the number of tokens in `text` without calling a tokenizer.
+    Uses the ~4 characters per token rule, but never less than one token per word.
+    """
+    if not text:
+        return 0
+    return max(math.ceil(len(text) / CHARS_PER_TOKEN), len(text.split()))
+
+
+def message_tokens(message):
+    return TOKENS_PER_MESSAGE + estimate_tokens(message["content"])
+
+
+@lru_cache(maxsize=512)
+def summarize_turns(turns):
+    """
+    Summarize a block of (role, content) turns into one line per turn (first sentence, truncated).
+    Cached, so a block is only summarized once however many times the context is rebuilt.
+    """
+    lines = []
+    for role, content in turns:
+        first_sentence = re.split(r"(?<=[.!?])\s|\n", content.strip(), maxsplit=1)[0]
+        if len(first_sentence) > SUMMARY_CHARS_PER_TURN:
+            first_sentence = first_sentence[:SUMMARY_CHARS_PER_TURN - 3] + "..."
+        lines.append(f"{role}: {first_sentence}")
+    return "\n".join(lines)
+
+
+def _summarize_older_turns(messages, budget):
+    # Blocks are aligned to the start of the conversation, so all but the last block are
+    # identical from one turn to the next and come straight from the summarize_turns cache
+    blocks = []
+    for start in range(0, len(messages), SUMMARY_BLOCK_SIZE):
+        block = tuple((m["role"], m["content"]) for m in messages[start:start + SUMMARY_BLOCK_SIZE])
+        blocks.append(summarize_turns(block))
+
+    # Keep the most recent block summaries that fit the summary budget
+    kept = []
+    used = 0
+    for summary in reversed(blocks):
+        tokens = estimate_tokens(summary)
+        if used + tokens > budget:
+            break
+        kept.insert(0, summary)
+        used += tokens
+    return "\n".join(kept)
+
+
+def build_context(system_prompt, messages, budget=CONTEXT_TOKEN_BUDGET, summary_budget=SUMMARY_TOKEN_BUDGET):
+    """
+    Build the message list for a chat completion within a token budget.
+
+    The system prompt and the latest turn are always sent. Earlier turns are added newest first
+    while they fit; the rest are replaced by a summary. Returns (conversation, usage) where usage
+    holds the estimated token counts of each part.
+    """
+    system = {"role": "system", "content": system_prompt}
+    system_tokens = message_tokens(system)
+
+    recent = []
+    recent_tokens = 0
+    available = budget - system_tokens - summary_budget
+    for message in reversed(messages):
+        tokens = message_tokens(message)
+        if recent and recent_tokens + tokens > available:
+            break
+        recent.insert(0, message)
+        recent_tokens += tokens
+
+    conversation = [system]
+    summary_tokens = 0
+    older = messages[:len(messages) - len(recent)]
+    if older:
+        summary = _summarize_older_turns(older, summary_budget)
+        if summary:
+            summary_message = {"role": "system", "content": f"Summary of the earlier conversation:\n{summary}"}
+            summary_tokens = message_tokens(summary_message)
+            conversation.append(summary_message)
+    conversation.extend({"role": m["role"], "content": m["content"]} for m in recent)
+
+    usage = {
+        "system_tokens": system_tokens,
+        "summary_tokens": summary_tokens,
+        "recent_tokens": recent_tokens,
+        "estimated_prompt_tokens": system_tokens + summary_tokens + recent_tokens,
+        "turns_sent": len(recent),
+        "turns_summarized": len(older),
+    }
+    return conversation, usage
+
+
+class DirectiveScanner:
+    """
+    Incrementally scan streamed model output for `query:` directives.
+    A directive is reported as soon as the line containing it is complete; a response
+    may contain any number of them, on separate lines or on the same one.
+    """
+
+    def __init__(self, marker="query:"):
+        self.marker = marker
+        self._pending = ""
+
+    def _directives(self, line):
+        return [part.strip() for part in line.split(self.marker)[1:] if part.strip()]
+
+    def feed(self, text):
+        """Add streamed text; return the directives completed by it."""
+        self._pending += text
+        *lines, self._pending = self._pending.split("\n")
+        return [d for line in lines for d in self._directives(line)]
+
+    def finish(self):
+        """Flush the final (unterminated) line at the end of the stream."""
+        directives = self._directives(self._pending)
+        self._pending = ""
+        return directives
+
+
+def find_directives(text):
+    """Return every `query:` directive in a complete response."""
+    scanner = DirectiveScanner()
+    return scanner.feed(text) + scanner.finish()
+
+
+def stream_completion(create, on_text=None, on_directive=None, should_stop=None, **kwargs):
+    """
+    Run a streaming chat completion through `create` (e.g. openai.chat.completions.create).
+
+    `on_text(text_so_far)` is called for every content delta and `on_directive(directive)` for every
+    `query:` line as soon as it is complete. If `should_stop()` returns True the stream is closed
+    early, stats["stopped"] is set and the unfinished last line is not scanned. Returns (full_text, stats) where stats holds the
+    time to first token, total latency and, when the endpoint reports it, token usage.
+    """
+    scanner = DirectiveScanner()
+    parts = []
+    stats = {}
+    started = time.perf_counter()
+
+    stream = create(stream=True, stream_options={"include_usage": True}, **kwargs)
+    for chunk in stream:
+        if should_stop and should_stop():
+            stats["stopped"] = True
+            if hasattr(stream, "close"):
+                stream.close()  # Stop receiving (and paying for) the rest of the response
+            break
+        if getattr(chunk, "usage", None) is not None:
+            stats["prompt_tokens"] = chunk.usage.prompt_tokens
+            stats["completion_tokens"] = chunk.usage.completion_tokens
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta.content
+        if not delta:
+            continue
+        if "ttft_seconds" not in stats:
+            stats["ttft_seconds"] = time.perf_counter() - started
+        parts.append(delta)
+        if on_text:
+            on_text("".join(parts))
+        for directive in scanner.feed(delta):
+            if on_directive:
+                on_directive(directive)
+
+    # A stopped stream's last line is cut off; dispatching it would run a lookup on a partial value
+    if not stats.get("stopped"):
+        for directive in scanner.finish():
+            if on_directive:
+                on_directive(directive)
+    stats["total_seconds"] = time.perf_counter() - started
+    return "".join(parts), stats
+
+
+def normalize_prompt(text):
+    """Normalize a prompt for cache lookups: case, whitespace and trailing punctuation don't matter."""
+    return re.sub(r"\s+", " ", text).strip().lower().rstrip("?!. ")
+
+
+class ResponseCache:
+    """
+    SQLite-backed cache of model responses with TTL expiry, LRU eviction and a size cap.
+    Safe to share between threads.
+    """
+
+    def __init__(self, path=RESPONSE_CACHE_DB, ttl=RESPONSE_CACHE_TTL,
+                 max_entries=RESPONSE_CACHE_MAX_ENTRIES, max_bytes=RESPONSE_CACHE_MAX_BYTES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=10)
+        self._conn.execute("PRAGMA journal_mode = WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, response TEXT NOT NULL, size INTEGER NOT NULL, "
+            "created_at REAL NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_lru ON responses (last_access)")
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(model, conversation, schema_version):
+        """
+        Key a request on the model, the normalized latest prompt, the rest of the (already trimmed)
+        context and the database schema version.
+        """
+        *context, latest = conversation
+        payload = json.dumps({
+            "model": model,
+            "prompt": normalize_prompt(latest["content"]),
+            "context": [(m["role"], m["content"]) for m in context],
+            "schema_version": schema_version,
+        })
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        now = time.time()
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT response, created_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or now - row[1] > self.ttl:
+                if row is not None:
+                    self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+            self.hits += 1
+            return row[0]
+
+    def put(self, key, response):
+        now = time.time()
+        size = len(response.encode("utf-8"))
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, response, size, created_at, last_access) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (key, response, size, now, now),
+            )
+            self._conn.execute("DELETE FROM responses WHERE created_at < ?", (now - self.ttl,))
+            self._evict()
+
+    def _evict(self):
+        # Drop least recently used entries until both the entry and byte caps are met
+        count, total = self._conn.execute("SELECT count(*), coalesce(sum(size), 0) FROM responses").fetchone()
+        if count <= self.max_entries and total <= self.max_bytes:
+            return
+        for key, size in self._conn.execute(
+            "SELECT key, size FROM responses ORDER BY last_access ASC"
+        ).fetchall():
+            if count <= self.max_entries and total <= self.max_bytes:
+                break
+            self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            count -= 1
+            total -= size
+            self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            count, total = self._conn.execute(
+                "SELECT count(*), coalesce(sum(size), 0) FROM responses"
+            ).fetchone()
+            return {"entries": count, "bytes": total, "hits": self.hits,
+                    "misses": self.misses, "evictions": self.evictions}
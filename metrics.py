@@ -0,0 +1,196 @@
+import bisect
+import contextvars
+import json
+import math
+import os
+import tempfile
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from functools import wraps
+
+# Local exports of the collected timings
+METRICS_JSONL = 'metrics.jsonl'  # One line per script run, with every span
+METRICS_PROM = 'metrics.prom'  # Prometheus text format, for node_exporter's textfile collector
+METRICS_PREFIX = 'chatbot'  # Prefix of the exported Prometheus metric names
+
+ROLLING_WINDOW = 200  # Durations per stage kept for a session's rolling percentiles
+RECENT_RUNS = 20  # Script runs kept per session for the stage breakdown
+PERCENTILES = (50, 90, 99)
+# Histogram bucket upper bounds, in seconds
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+_export_lock = threading.Lock()
+_current_trace = contextvars.ContextVar("metrics_trace", default=None)
+
+
+class Trace:
+    """Spans recorded during one script run of a session."""
+
+    def __init__(self, session_id, label=None):
+        self.session_id = session_id
+        self.label = label
+        self.started_at = time.time()
+        self.spans = []  # (name, start offset, seconds); appended from lookup threads too
+
+    def record(self, name, seconds, started=None):
+        offset = (started if started is not None else time.time() - seconds) - self.started_at
+        self.spans.append((name, offset, seconds))
+
+    def stages(self):
+        """Total seconds per stage name, in the order the stages first appeared."""
+        totals = {}
+        for name, _, seconds in list(self.spans):
+            totals[name] = totals.get(name, 0.0) + seconds
+        return totals
+
+    def to_dict(self):
+        return {
+            "session": self.session_id,
+            "label": self.label,
+            "timestamp": self.started_at,
+            "stages": {name: round(seconds * 1000, 3) for name, seconds in self.stages().items()},
+            "spans": [{"name": name, "offset_ms": round(offset * 1000, 3), "duration_ms": round(seconds * 1000, 3)}
+                      for name, offset, seconds in list(self.spans)],
+        }
+
+
+class Histogram:
+    """Cumulative Prometheus-style histogram of durations per stage, shared by the whole process."""
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._series = {}  # stage -> [count per bucket..., count above the last bucket, total count, sum]
+
+    def observe(self, name, seconds):
+        position = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            series = self._series.get(name)
+            if series is None:
+                series = self._series[name] = [0] * (len(self.buckets) + 3)
+            series[position] += 1  # Counts per bucket; made cumulative on export
+            series[-2] += 1
+            series[-1] += seconds
+
+    def prometheus_text(self, prefix=METRICS_PREFIX):
+        metric = f"{prefix}_stage_duration_seconds"
+        lines = [f"# HELP {metric} Duration of instrumented stages.", f"# TYPE {metric} histogram"]
+        with self._lock:
+            snapshot = {name: list(series) for name, series in self._series.items()}
+        for name, series in sorted(snapshot.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                lines.append(f'{metric}_bucket{{stage="{name}",le="{bound}"}} {cumulative}')
+            lines.append(f'{metric}_bucket{{stage="{name}",le="+Inf"}} {series[-2]}')
+            lines.append(f'{metric}_sum{{stage="{name}"}} {series[-1]}')
+            lines.append(f'{metric}_count{{stage="{name}"}} {series[-2]}')
+        return "\n".join(lines) + "\n"
+
+
+histogram = Histogram()
+
+
+def record(name, seconds):
+    """Record a duration measured elsewhere (e.g. time to first token) as a stage."""
+    histogram.observe(name, seconds)
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.record(name, seconds)
+
+
+@contextmanager
+def span(name):
+    """Time the enclosed block as stage `name`, in the process histogram and the active trace."""
+    started_at = time.time()
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - started
+        histogram.observe(name, seconds)
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.record(name, seconds, started_at)
+
+
+def timed(name):
+    """Decorator form of span()."""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def start_trace(session_id, label=None):
+    """Start collecting the spans of this thread (and of contexts copied from it) into a new Trace."""
+    trace = Trace(session_id, label)
+    _current_trace.set(trace)
+    return trace
+
+
+def current_trace():
+    return _current_trace.get()
+
+
+def finish_trace(trace, session_stats=None, jsonl_path=METRICS_JSONL, prom_path=METRICS_PROM):
+    """Stop collecting into `trace`, add it to the session's stats and write the exports."""
+    if _current_trace.get() is trace:
+        _current_trace.set(None)
+    if session_stats is not None:
+        session_stats.add(trace)
+    try:
+        if jsonl_path:
+            export_jsonl(trace, jsonl_path)
+        if prom_path:
+            write_prometheus(prom_path)
+    except OSError as e:
+        print(f"Could not export metrics: {e}")
+
+
+def export_jsonl(trace, path=METRICS_JSONL):
+    line = json.dumps(trace.to_dict())
+    with _export_lock, open(path, 'a') as file:
+        file.write(line + "\n")
+
+
+def write_prometheus(path=METRICS_PROM):
+    # Write to a temp file first, so a scrape never reads a half-written file
+    directory = os.path.dirname(os.path.abspath(path))
+    with _export_lock:
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        with os.fdopen(fd, 'w') as file:
+            file.write(histogram.prometheus_text())
+        os.replace(tmp_path, path)
+
+
+class SessionStats:
+    """Rolling per-stage durations and the most recent traces of one session."""
+
+    def __init__(self, window=ROLLING_WINDOW, recent=RECENT_RUNS):
+        self.window = window
+        self.durations = {}  # stage -> deque of seconds
+        self.recent = deque(maxlen=recent)
+
+    def add(self, trace):
+        stages = trace.stages()
+        for name, seconds in stages.items():
+            self.durations.setdefault(name, deque(maxlen=self.window)).append(seconds)
+        self.recent.append((trace.label, trace.started_at, stages))
+
+    def percentiles(self, percentiles=PERCENTILES):
+        """{stage: {"count": n, "p50": seconds, ...}} over the rolling window."""
+        summary = {}
+        for name, values in self.durations.items():
+            ordered = sorted(values)
+            summary[name] = {"count": len(ordered)}
+            for p in percentiles:
+                # Nearest-rank percentile
+                rank = max(math.ceil(p / 100 * len(ordered)) - 1, 0)
+                summary[name][f"p{p}"] = ordered[rank]
+        return summary
@@ -0,0 +1,134 @@
+import threading
+import weakref
+import numpy as np
+import pandas as pd
+
+INDEX_CHUNK_ROWS = 100_000  # Rows read at a time when indexing a staged (on-disk) upload
+
+
+class ColumnRangeIndex:
+    """
+    Precomputed index of one column that answers aggregations over any row range [start, end)
+    without rescanning the rows in it.
+
+    Category counts use the factorized codes sorted by (code, position): the number of rows of a
+    category inside a range is the difference of two binary searches, done for all categories at
+    once. Numeric columns also keep prefix sums, so range sums and means are a single subtraction.
+    """
+
+    def __init__(self, codes, categories, values=None):
+        self.length = len(codes)
+        self.codes = codes
+        self.categories = categories
+        # Sorted composite keys: code * (n + 1) + position, so each category's positions are contiguous
+        stride = self.length + 1
+        valid = np.flatnonzero(codes >= 0)
+        self._stride = stride
+        self._keys = np.sort(codes[valid].astype(np.int64) * stride + valid)
+
+        self._prefix_sums = None
+        self._prefix_counts = None
+        if values is not None:
+            present = ~np.isnan(values)
+            self._prefix_sums = np.concatenate(([0.0], np.cumsum(np.where(present, values, 0.0))))
+            self._prefix_counts = np.concatenate(([0], np.cumsum(present)))
+
+    @classmethod
+    def from_series(cls, series):
+        codes, categories = pd.factorize(series, use_na_sentinel=True)
+        values = None
+        if pd.api.types.is_numeric_dtype(series.dtype) and not pd.api.types.is_bool_dtype(series.dtype):
+            values = series.to_numpy(dtype=float, na_value=np.nan)
+        return cls(codes, categories, values)
+
+    @classmethod
+    def from_chunks(cls, chunks):
+        """Build from consecutive Series chunks (e.g. read from a staged upload), keeping one chunk in memory."""
+        categories = pd.Index([])
+        code_parts = []
+        value_parts = []
+        numeric = True
+        for chunk in chunks:
+            if isinstance(chunk.dtype, pd.CategoricalDtype):
+                chunk = chunk.astype(chunk.cat.categories.dtype)
+            # Map the chunk onto the categories seen so far, appending any new ones
+            new = pd.Index(chunk.dropna().unique()).difference(categories, sort=False)
+            if len(new):
+                categories = categories.append(new)
+            code_parts.append(categories.get_indexer(chunk))
+            numeric = numeric and pd.api.types.is_numeric_dtype(chunk.dtype) \
+                and not pd.api.types.is_bool_dtype(chunk.dtype)
+            if numeric:
+                value_parts.append(chunk.to_numpy(dtype=float, na_value=np.nan))
+        codes = np.concatenate(code_parts) if code_parts else np.array([], dtype=np.intp)
+        values = np.concatenate(value_parts) if numeric and value_parts else None
+        return cls(codes, categories, values)
+
+    def _clip(self, start, end):
+        start = min(max(int(start), 0), self.length)
+        return start, min(max(int(end), start), self.length)
+
+    def category_counts(self, start, end):
+        """Number of rows of every category within [start, end), as an array aligned with `categories`."""
+        start, end = self._clip(start, end)
+        if end - start < len(self.categories):
+            # Short range over many categories: counting the rows directly is cheaper
+            codes = self.codes[start:end]
+            return np.bincount(codes[codes >= 0], minlength=len(self.categories))
+        bases = np.arange(len(self.categories), dtype=np.int64) * self._stride
+        return np.searchsorted(self._keys, bases + end) - np.searchsorted(self._keys, bases + start)
+
+    def value_counts(self, start, end):
+        """Equivalent of `series.iloc[start:end].value_counts()`."""
+        counts = self.category_counts(start, end)
+        order = np.argsort(-counts, kind="stable")
+        order = order[counts[order] > 0]
+        return pd.Series(counts[order], index=self.categories[order], name="count")
+
+    @property
+    def is_numeric(self):
+        return self._prefix_sums is not None
+
+    def range_sums(self, starts, ends):
+        """Sums of the (non-missing) values within each [starts[i], ends[i]) range (clipped to the column)."""
+        ends = np.clip(np.asarray(ends), 0, self.length)
+        starts = np.clip(np.asarray(starts), 0, ends)
+        return self._prefix_sums[ends] - self._prefix_sums[starts]
+
+    def range_means(self, starts, ends):
+        """Means of the (non-missing) values within each [starts[i], ends[i]) range; NaN for empty ranges."""
+        ends = np.clip(np.asarray(ends), 0, self.length)
+        starts = np.clip(np.asarray(starts), 0, ends)
+        counts = self._prefix_counts[ends] - self._prefix_counts[starts]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.where(counts > 0, self.range_sums(starts, ends) / counts, np.nan)
+
+
+_indexes = {}  # id(data) -> {column: ColumnRangeIndex}
+_indexes_lock = threading.Lock()
+
+
+def get_range_index(data, column):
+    """
+    Return the ColumnRangeIndex of `column` in `data` (a DataFrame or StagedTable), building it the
+    first time the column is used. Indexes live as long as the data object they were built from.
+    """
+    key = id(data)
+    with _indexes_lock:
+        columns = _indexes.get(key)
+        if columns is None:
+            columns = _indexes[key] = {}
+            weakref.finalize(data, _indexes.pop, key, None)
+        index = columns.get(column)
+    if index is not None:
+        return index
+
+    if isinstance(data, pd.DataFrame):
+        index = ColumnRangeIndex.from_series(data[column])
+    else:
+        chunks = (data.column(column, start, start + INDEX_CHUNK_ROWS)
+                  for start in range(0, len(data), INDEX_CHUNK_ROWS))
+        index = ColumnRangeIndex.from_chunks(chunks)
+    with _indexes_lock:
+        columns[column] = index
+    return index
@@ -0,0 +1,148 @@
+import math
+import re
+import threading
+from collections import Counter, OrderedDict
+import numpy as np
+from llm import estimate_tokens
+from metrics import timed
+
+# Chunking of document text
+CHUNK_WORDS = 200  # Words per chunk (~250-300 tokens)
+CHUNK_OVERLAP = 40  # Words shared with the previous chunk, so a passage cut at a boundary is still found
+
+# BM25 parameters (the usual defaults)
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+INDEX_CACHE_SIZE = 16  # Document indexes kept in memory, keyed by upload hash
+
+_TOKEN_RE = re.compile(r"\w+")
+_WORD_RE = re.compile(r"\S+")
+STOPWORDS = frozenset(
+    "a an and are as at be but by for from has have he her his i in is it its of on or she that the their "
+    "them there they this to was were what when where which who will with you your".split()
+)
+
+
+def tokenize(text):
+    return [token for token in _TOKEN_RE.findall(text.lower()) if token not in STOPWORDS]
+
+
+def chunk_text(text, chunk_words=CHUNK_WORDS, overlap=CHUNK_OVERLAP):
+    """Split `text` into overlapping windows of `chunk_words` words, keeping the original spacing."""
+    spans = [match.span() for match in _WORD_RE.finditer(text)]
+    step = max(chunk_words - overlap, 1)
+    chunks = []
+    for start in range(0, len(spans), step):
+        window = spans[start:start + chunk_words]
+        chunks.append(text[window[0][0]:window[-1][1]])
+        if start + chunk_words >= len(spans):
+            break
+    return chunks
+
+
+class BM25Index:
+    """
+    In-memory inverted index of text chunks with BM25 ranking.
+
+    Each term maps to the ids of the chunks containing it and its frequency in each, so a query
+    only touches the postings of its own terms and scores them with a few vectorized operations.
+    """
+
+    def __init__(self, chunks, k1=BM25_K1, b=BM25_B):
+        self.chunks = chunks
+        self.k1 = k1
+        postings = {}
+        lengths = np.zeros(len(chunks), dtype=np.float64)
+        for chunk_id, chunk in enumerate(chunks):
+            counts = Counter(tokenize(chunk))
+            lengths[chunk_id] = sum(counts.values())
+            for term, count in counts.items():
+                postings.setdefault(term, ([], []))
+                postings[term][0].append(chunk_id)
+                postings[term][1].append(count)
+
+        n = len(chunks)
+        self._postings = {}
+        for term, (ids, counts) in postings.items():
+            idf = math.log(1 + (n - len(ids) + 0.5) / (len(ids) + 0.5))
+            self._postings[term] = (np.array(ids, dtype=np.int32), np.array(counts, dtype=np.float64), idf)
+        # Length normalization of each chunk, the part of the BM25 denominator that doesn't depend on the term
+        average = lengths.mean() if n else 0.0
+        self._norm = k1 * (1 - b + b * lengths / average) if average else np.full(n, k1)
+
+    @classmethod
+    def from_text(cls, text, chunk_words=CHUNK_WORDS, overlap=CHUNK_OVERLAP):
+        return cls(chunk_text(text, chunk_words, overlap))
+
+    def __len__(self):
+        return len(self.chunks)
+
+    @timed("retrieval.search")
+    def search(self, query, k=4):
+        """Return up to `k` (chunk_id, score) pairs, best first; chunks sharing no term with the query are left out."""
+        if k <= 0:
+            return []
+        scores = np.zeros(len(self.chunks))
+        for term in set(tokenize(query)):
+            posting = self._postings.get(term)
+            if posting is None:
+                continue
+            ids, tf, idf = posting
+            scores[ids] += idf * tf * (self.k1 + 1) / (tf + self._norm[ids])
+
+        matched = np.flatnonzero(scores)
+        if len(matched) > k:
+            matched = matched[np.argpartition(-scores[matched], k - 1)[:k]]
+        best = matched[np.argsort(-scores[matched], kind="stable")]
+        return [(int(i), float(scores[i])) for i in best]
+
+
+def relevant_excerpts(index, query, k=4, token_budget=1500):
+    """
+    Format the chunks of `index` most relevant to `query` for the prompt, best first, stopping
+    before `token_budget` (estimated tokens) is exceeded. Returns (text, number of chunks).
+    """
+    parts = []
+    used = 0
+    for chunk_id, _ in index.search(query, k):
+        part = f"[{len(parts) + 1}] {index.chunks[chunk_id]}"
+        tokens = estimate_tokens(part)
+        if used + tokens > token_budget:
+            break
+        parts.append(part)
+        used += tokens
+    return "\n\n".join(parts), len(parts)
+
+
+def document_text(data):
+    """Text of a parsed upload (TXT and DOCX give a string, PDF a dict with "text"); None for other uploads."""
+    if isinstance(data, str):
+        return data
+    if isinstance(data, dict) and isinstance(data.get("text"), str):
+        return data["text"]
+    return None
+
+
+_index_cache = OrderedDict()
+_index_cache_lock = threading.Lock()
+
+
+@timed("retrieval.index")
+def get_document_index(key, text, max_entries=INDEX_CACHE_SIZE):
+    """
+    Return the BM25Index of `text`, built once per `key` (the upload's content hash) and kept in an
+    LRU cache shared by all sessions.
+    """
+    with _index_cache_lock:
+        index = _index_cache.get(key)
+        if index is not None:
+            _index_cache.move_to_end(key)
+            return index
+
+    index = BM25Index.from_text(text)
+    with _index_cache_lock:
+        _index_cache[key] = index
+        while len(_index_cache) > max_entries:
+            _index_cache.popitem(last=False)
+    return index
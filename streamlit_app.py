@@ -1,97 +1,199 @@
-import openai
 import streamlit as st
-import requests  # Added for downloading the .db file from GitHub
 import sqlite3
 import os
+import uuid
+import time
+import tempfile
+from concurrent.futures import CancelledError
 import pandas as pd
-from utils import load_chat_history, save_chat_history
-from visualizations import generate_pie_chart, generate_bar_chart
-from file_handlers import handle_uploaded_file
-
-# Load API key from Streamlit's secrets
-openai.api_key = st.secrets["openai"]["api_key"]
+from database import build_search_index, fetch_database, fetch_query_page, get_connection_pool, get_schema_catalog
+from llm import CONTEXT_TOKEN_BUDGET, ResponseCache, build_context, find_directives, stream_completion
+from utils import append_chat_message, clear_chat_history, load_chat_history
+from visualizations import generate_pie_chart, generate_bar_chart, preview_uploaded_file
+from file_handlers import (ParsedUploadCache, bind_cache_dir, parse_job_kind, parse_upload_bytes,
+                           supported_extensions)
+from index_advisor import advisor_report, create_indexes, indexed_copy
+from jobs import JobQueueFull, cancel_requested, current_job, get_executor
+from metrics import SessionStats, finish_trace, record, span, start_trace
+from retrieval import document_text, get_document_index, relevant_excerpts
 
 # Set model parameters
 OPENAI_MODEL = "gpt-4"  # Set the model you want to use
 MAX_TOKENS = 2500  # Set the max token limit for the OpenAI API
 
+# System prompt sent with every request; {schema} is filled from the cached schema catalog
+SYSTEM_PROMPT = (
+    "You are a helpful assistant that can help with database queries. "
+    "To look up records, reply with a line of the form `query: table|column|value`; "
+    "write the value as `=value` to match it exactly instead of as a substring. "
+    "Use one line per lookup when several are needed.\n"
+    "The database has these tables:\n{schema}"
+)
+
 # GitHub repository URL for the raw .db file
 GITHUB_DB_URL = "https://github.com/Divyamm05/chatbot/raw/main/chinook.db"  # Raw link to GitHub file
-
-# File to store chat history
-CHAT_HISTORY_FILE = 'chat_history.json'
-
-# Load the previous chat history if available
+DB_PATH = "database2.db"  # Local copy of the downloaded database
+DB_REFRESH_SECONDS = 3600  # How long the local copy is trusted before revalidating with GitHub
+ENABLE_SEARCH_INDEX = True  # Build a trigram full-text index so substring lookups avoid full table scans
+AUTO_CREATE_INDEXES = False  # Create the index advisor's recommendations without waiting for the sidebar button
+
+# Paging of database lookups shown in the chat
+QUERY_PAGE_SIZE = 50  # Rows fetched per page
+QUERY_MAX_ROWS = 1000  # Stop offering "Load more" after this many rows
+QUERY_SUMMARY_ROWS = 5  # Rows quoted in the chat transcript
+
+# Model requests, lookups and upload parsing run as background jobs (see jobs.py) that reruns poll
+JOB_POLL_SECONDS = 0.1  # How often a pending job's progress is redrawn
+UPLOAD_INLINE_WAIT = 0.5  # Uploads parsed within this time are shown in the same run
+
+# Memory budget for parsed uploads kept across reruns (evicted entries spill to a temp dir)
+UPLOAD_CACHE_MAX_BYTES = 512 * 1024 * 1024
+
+# Retrieval over uploaded documents (TXT, DOCX, PDF): only the most relevant chunks are sent with a turn
+RETRIEVAL_TOP_K = 4  # Chunks attached to each turn
+RETRIEVAL_TOKEN_BUDGET = 1500  # Estimated tokens the attached chunks may use
+
+# Stage timings: every script run is traced and appended to these files (None disables an export)
+METRICS_JSONL_PATH = "metrics.jsonl"
+METRICS_PROM_PATH = "metrics.prom"
+PERF_PANEL_RUNS = 10  # Script runs shown in the sidebar performance panel
+
+# Identify the chat session; kept in the URL so a page reload resumes the same history
+if "session_id" not in st.session_state:
+    st.session_state.session_id = st.query_params.get("session") or uuid.uuid4().hex
+    st.query_params["session"] = st.session_state.session_id
+
+# Time each stage of this script run (DB, uploads, model, lookups, charts) for the performance panel
+run_trace = start_trace(st.session_state.session_id)
+if "perf_stats" not in st.session_state:
+    st.session_state.perf_stats = SessionStats()
+
+# Load the recent chat history of this session if available
 if "messages" not in st.session_state:
-    st.session_state.messages = load_chat_history()
-
-# Function to download the .db file from GitHub
+    with span("app.load_history"):
+        st.session_state.messages = load_chat_history(st.session_state.session_id)
+
+# The OpenAI client is imported on the first chat request rather than on every cold start;
+# the API key is loaded from Streamlit's secrets
+@st.cache_resource
+def get_openai():
+    import openai
+    openai.api_key = st.secrets["openai"]["api_key"]
+    return openai
+
+# Function to add a message to the conversation and append it to the history store
+def add_message(role, content):
+    message = {"role": role, "content": content}
+    st.session_state.messages.append(message)
+    append_chat_message(st.session_state.session_id, message)
+
+# Function to fetch the .db file from GitHub, cached once per process.
+# The fetch layer revalidates with ETag/Last-Modified, so reruns never re-download an unchanged file.
+@st.cache_resource(ttl=DB_REFRESH_SECONDS, show_spinner=False)
 def download_db_from_github():
-    try:
-        response = requests.get(GITHUB_DB_URL)
-        if response.status_code == 200:
-            # Save the database file temporarily in the current directory
-            with open("database2.db", "wb") as f:
-                f.write(response.content)
-            if os.path.exists("database2.db") and os.path.getsize("database2.db") > 0:
-                st.success("Downloaded database from GitHub successfully!")
-            else:
-                st.error("Downloaded database is empty or invalid.")
-        else:
-            st.error(f"Failed to download the database from GitHub. Status code: {response.status_code}")
-    except Exception as e:
-        st.error(f"Error downloading database: {str(e)}")
-
-# Download the .db file from GitHub every time the app runs
-download_db_from_github()
-
-# Function to connect to the SQLite database
-def connect_to_db(db_path):
-    try:
-        conn = sqlite3.connect(db_path)
-        return conn
-    except sqlite3.DatabaseError as e:
-        st.error(f"Database connection error: {e}")
-        return None
+    status, error = fetch_database(GITHUB_DB_URL, DB_PATH, max_age=DB_REFRESH_SECONDS)
+    rebuilt = False
+    if ENABLE_SEARCH_INDEX and error is None:
+        try:
+            rebuilt = build_search_index(DB_PATH)
+        except sqlite3.Error as e:
+            print(f"Could not build the search index: {e}")  # Lookups fall back to LIKE
+    if status == "updated" or rebuilt:
+        # Pooled connections still read the replaced file (or lack the new index); retire them
+        get_connection_pool(DB_PATH).reset()
+    return status, error
+
+with span("app.download_db"):
+    db_status, db_error = download_db_from_github()
+if db_error:
+    st.error(db_error)
+    download_db_from_github.clear()  # Don't cache failures; retry on the next rerun
 
 # Function to execute a dynamic query
-def execute_dynamic_query(conn, table_name, column_name, search_value):
+def execute_dynamic_query(conn, table_name, column_name, search_value, exact_match=False):
     """
     Executes a dynamic query to search for a specific value in a given column of a table.
+    Only the first page of matches is read; further pages are fetched on demand ("Load more").
 
     Parameters:
     - conn: SQLite database connection
     - table_name: Name of the table to query
     - column_name: Name of the column to search
     - search_value: The value to search for in the column
+    - exact_match: Match the whole value instead of a substring
 
     Returns:
-    - result: Query result (as a DataFrame)
+    - result: Dict describing the lookup and its first page (see database.fetch_query_page)
     - error: Error message if any
     """
-    try:
-        # Create the query string
-        query = f"SELECT * FROM {table_name} WHERE {column_name} LIKE ?"
-        
-        # Execute the query
-        cursor = conn.cursor()
-        cursor.execute(query, ('%' + search_value + '%',))  # Use parameterized query to avoid SQL injection
-        result = cursor.fetchall()
-
-        # Check if we got any results
-        if result:
-            # Convert the result into a pandas DataFrame for better display
-            df = pd.DataFrame(result, columns=[desc[0] for desc in cursor.description])
-            return df, None  # Return result and no error
-        else:
-            return "No matching records found.", None
-
-    except sqlite3.Error as e:
-        return None, str(e)  # Return error message
-
-# Initialize database connection
-conn = connect_to_db("database2.db")
-if conn is None:
+    page, error = fetch_query_page(conn, table_name, column_name, search_value, exact_match=exact_match,
+                                   page_size=QUERY_PAGE_SIZE)
+    if error:
+        return None, error
+    if not page["rows"]:
+        return "No matching records found.", None
+    return {"table": table_name, "column": column_name, "value": search_value, "exact_match": exact_match,
+            **page}, None
+
+# Function to run the lookup described by a `query:` directive (table|column|value)
+def run_lookup(directive):
+    # Ensure we split into 3 components: table_name, column_name, and search_value
+    query_parts = directive.split("|")
+    if len(query_parts) != 3:
+        return None, "Invalid query format returned by the model."
+    table_name, column_name, search_value = [part.strip() for part in query_parts]
+    exact_match = search_value.startswith("=")
+    if exact_match:
+        search_value = search_value[1:].strip()
+    # Each lookup borrows its own pooled connection, so several can run at once
+    with db_pool.connection() as conn:
+        return execute_dynamic_query(conn, table_name, column_name, search_value, exact_match)
+
+# Response cache shared by all sessions (stored on disk, so it also survives restarts)
+@st.cache_resource
+def get_response_cache():
+    return ResponseCache()
+
+# Function to describe a query result compactly for the chat transcript
+def summarize_query_result(result):
+    shown = len(result["rows"])
+    more = "+" if result["has_more"] else ""
+    preview = "\n".join(f"- {row}" for row in result["rows"][:QUERY_SUMMARY_ROWS])
+    match = "equals" if result.get("exact_match") else "matches"
+    return (f"Query results: {shown}{more} rows from {result['table']} where {result['column']} "
+            f"{match} '{result['value']}'.\n{preview}")
+
+# Function to render a query result with a "Load more" button
+def render_query_result(result, key):
+    st.dataframe(pd.DataFrame(result["rows"], columns=result["columns"]))
+    if result["has_more"] and len(result["rows"]) < QUERY_MAX_ROWS:
+        if st.button("Load more", key=f"load_more_{key}"):
+            page_size = min(QUERY_PAGE_SIZE, QUERY_MAX_ROWS - len(result["rows"]))
+            with db_pool.connection() as conn:
+                page, error = fetch_query_page(conn, result["table"], result["column"], result["value"],
+                                               exact_match=result.get("exact_match", False),
+                                               after_rowid=result["last_rowid"], page_size=page_size)
+            if error:
+                st.error(error)
+            else:
+                result["rows"].extend(page["rows"])
+                result["last_rowid"] = page["last_rowid"]
+                result["has_more"] = page["has_more"]
+                st.rerun()
+
+# Function to create the index advisor's recommendations in the writable indexed copy of the database
+def apply_index_recommendations(recommendations):
+    copy_path = create_indexes(DB_PATH, recommendations)
+    # Pooled connections to an earlier copy still read the replaced file; retire them
+    get_connection_pool(copy_path).reset()
+
+# Shared, read-only connection pool for the database (one per process, reused across reruns).
+# Once the index advisor has created indexes, lookups use its indexed copy of the current download.
+db_pool = get_connection_pool(indexed_copy(DB_PATH) or DB_PATH)
+try:
+    with span("app.connect"), db_pool.connection():
+        pass
+except sqlite3.Error:
     st.error("Failed to connect to the database. Please check the .db file.")
 
 # Sidebar for chart selection and file attachment
@@ -104,8 +206,10 @@ with st.sidebar:
     with col1:
         # Sidebar: Add the "Start New Chat" button next to the title
         if st.button('Start New Chat'):
+            if "pending_turn" in st.session_state:
+                get_executor().cancel(st.session_state.pop("pending_turn")["job"])  # Stop a reply still streaming
             st.session_state.messages = []  # Clears the chat history
-            save_chat_history(st.session_state.messages)  # Save the empty history
+            clear_chat_history(st.session_state.session_id)  # Remove the stored history
             st.rerun()  # Rerun the app to refresh the interface
 
     # Sidebar: Add a dropdown menu for selecting chart type
@@ -114,29 +218,87 @@ with st.sidebar:
         ("Select a chart", "Pie Chart", "Bar Chart")
     )
 
+    # Skip the response cache for prompts whose answer should not be reused
+    bypass_cache = st.checkbox("Always ask the model (skip response cache)", value=False)
+
+    # Show where the time of recent runs went (rendered at the end of the script)
+    show_perf_panel = st.checkbox("Show performance panel", value=False)
+    show_index_advisor = st.checkbox("Show index advisor", value=False)
+
     # File uploader for attachments (moved below the chart selection and slider)
-    uploaded_file = st.file_uploader("Upload an attachment (optional)", type=["txt", "csv", "xlsx", "pdf", "jpg", "png", "docx"])
+    uploaded_file = st.file_uploader("Upload an attachment (optional)", type=supported_extensions())
+
+# Per-session temp directory for files derived from uploads (e.g. PDF page images). It is removed
+# when the session ends and its state is dropped, or at the latest when the server exits.
+if "upload_cache_dir" not in st.session_state:
+    st.session_state.upload_tmpdir = tempfile.TemporaryDirectory(prefix="chatbot-session-")
+    st.session_state.upload_cache_dir = st.session_state.upload_tmpdir.name
+
+# Parsed uploads are cached by content hash, so reruns don't parse the same file again
+@st.cache_resource
+def get_upload_cache():
+    return ParsedUploadCache(max_bytes=UPLOAD_CACHE_MAX_BYTES,
+                             spill_dir=os.path.join(tempfile.gettempdir(), "chatbot-upload-cache"))
+
+# Handle file uploads and visualization-related tasks.
+# Parsing runs as a background job (see file_handlers.parse_job_kind), so a large file doesn't hold up
+# the page; reruns while it runs find the same job (keyed by the upload's content hash) instead of
+# starting another parse.
+data, columns = None, []
+upload_job = None
+upload_status = st.empty()
+if uploaded_file is not None:
+    with span("upload.handle"):
+        upload_cache = get_upload_cache()
+        upload_key = upload_cache.key_for(uploaded_file)
+        parsed = upload_cache.get(upload_key, cache_dir=st.session_state.upload_cache_dir)
+        if parsed is None:
+            try:
+                upload_job = get_executor().submit(
+                    ("parse", upload_key), parse_upload_bytes, uploaded_file.getvalue(), uploaded_file.name,
+                    uploaded_file.type, st.session_state.upload_cache_dir, kind=parse_job_kind(uploaded_file)
+                )
+                if upload_job.wait(UPLOAD_INLINE_WAIT):
+                    parsed, parse_seconds = upload_job.result()
+                    record("upload.parse", parse_seconds)  # Measured in the job, where this run's metrics don't reach
+                    upload_cache.put(upload_key, parsed)
+                    # The job may have been started by another session uploading the same file
+                    parsed = bind_cache_dir(parsed, st.session_state.upload_cache_dir)
+                    get_executor().forget(upload_job.key)
+                    upload_job = None
+                else:
+                    upload_status.info("Parsing the uploaded file...")
+            except JobQueueFull as e:
+                upload_job = None
+                upload_status.warning(str(e))
+            except Exception as e:
+                get_executor().forget(("parse", upload_key))
+                upload_job = None
+                upload_status.error(f"Could not read the uploaded file: {e}")
+        if parsed is not None:
+            data, columns = parsed
+if len(columns) > 0:
+    preview_uploaded_file(data)
 
-# Handle file uploads and visualization-related tasks
-data, columns = handle_uploaded_file(uploaded_file)
+# Index the text of document uploads once per upload hash; chat turns search it instead of sending the whole text
+document_index = None
+if uploaded_file is not None and document_text(data):
+    document_index = get_document_index(get_upload_cache().key_for(uploaded_file), document_text(data))
 
 # Initialize data to None by default
+# Columns are tracked by name: large uploads are staged on disk and never loaded as whole columns
 x_column = None
 y_column = None
 pie_column = None  # Variable to store selected Pie Chart column
 if len(columns) > 0:
     # Pie chart and bar chart options for selecting columns
     if chart_type == "Bar Chart":
-        x_column_index = st.selectbox("Select X-axis column", options=columns)
-        x_column = data[x_column_index] if x_column_index else None
-
-        y_column_index = st.selectbox("Select Y-axis column", options=columns)
-        y_column = data[y_column_index] if y_column_index else None
+        x_column = st.selectbox("Select X-axis column", options=columns)
+        y_column = st.selectbox("Select Y-axis column", options=columns)
 
     elif chart_type == "Pie Chart":
         # Add the column selection for Pie Chart using dropdown
-        pie_column_index = st.selectbox("Select column for Pie Chart", options=columns)
-        pie_column = data[pie_column_index] if pie_column_index else None
+        pie_column = st.selectbox("Select column for Pie Chart", options=columns)
 
 # Conditionally display the sliders for range values for both axes
 if chart_type == "Bar Chart" and x_column is not None and y_column is not None:
@@ -144,15 +306,14 @@ if chart_type == "Bar Chart" and x_column is not None and y_column is not None:
     start_value, end_value = st.slider(
         "Select range of values to visualize",
         min_value=0,
-        max_value=len(x_column),  # Set max value to the length of the data
-        value=(0, min(10, len(x_column))),  # Default range (start from 0 to 10 or data length)
+        max_value=len(data),  # Set max value to the length of the data
+        value=(0, min(10, len(data))),  # Default range (start from 0 to 10 or data length)
         step=1,
         help="Select the start and end values for both X and Y axes"
     )
 
     if st.button("Generate Bar Chart"):
-        # Pass column names as strings (use .name to get the column name)
-        generate_bar_chart(data, x_column.name, y_column.name, start_value, end_value, start_value, end_value)
+        generate_bar_chart(data, x_column, y_column, start_value, end_value, start_value, end_value)
 
 
 # Pie chart dropdown functionality
@@ -168,68 +329,209 @@ if chart_type == "Pie Chart" and pie_column is not None:
     )
 
     if st.button("Generate Pie Chart"):
-        # Ensure that pie_column is not empty or None
-        if pie_column is not None and not pie_column.empty:
-            generate_pie_chart(data, pie_column.name, start_value, end_value)
+        # Ensure that the data is not empty
+        if len(data) > 0:
+            generate_pie_chart(data, pie_column, start_value, end_value)
         else:
             st.error("Please select a valid column for the Pie Chart")
 
+# Function run as a background job: get the model's reply (from the response cache or streamed),
+# starting each `query:` lookup as its own job as soon as its line is complete. The job outlives
+# reruns of the script, so interacting with the page while it runs no longer restarts the request.
+def complete_chat_turn(create, response_cache, cache_key, cached_response, conversation, bypass_cache=False):
+    job = current_job()
+    lookups = []
+
+    def start_lookup(directive):
+        lookups.append(get_executor().submit(None, run_lookup, directive))
+
+    if cached_response is not None:
+        for directive in find_directives(cached_response):
+            start_lookup(directive)
+        return cached_response, {"cache_hit": True, "total_seconds": 0.0}, lookups
+
+    def publish(text):
+        job.progress = text
+
+    full_response, stream_stats = stream_completion(
+        create,
+        on_text=publish,
+        on_directive=start_lookup,
+        should_stop=cancel_requested,
+        model=OPENAI_MODEL,
+        messages=conversation,
+        max_tokens=MAX_TOKENS
+    )
+    # A bypassed reply isn't stored either: bypassing is for prompts whose answers shouldn't be reused
+    if not stream_stats.get("stopped") and not bypass_cache:
+        response_cache.put(cache_key, full_response)
+    return full_response, stream_stats, lookups
+
+# Function to turn a finished chat job into the assistant's message
+def finish_chat_turn(job, token_usage, message_placeholder):
+    try:
+        full_response, stream_stats, lookups = job.result()
+    except CancelledError:
+        full_response, stream_stats, lookups = "", {"stopped": True, "total_seconds": 0.0}, []
+
+    # Record estimated and actual token usage and latency for this request
+    token_usage.update(stream_stats)
+    st.session_state.setdefault("token_usage", []).append(token_usage)
+    if not stream_stats.get("cache_hit") and not stream_stats.get("stopped"):
+        record("llm.completion", stream_stats["total_seconds"])
+        if "ttft_seconds" in stream_stats:
+            record("llm.first_token", stream_stats["ttft_seconds"])
+
+    # If the response contained database query instructions, merge the lookups' results in order
+    if lookups:
+        answers = []
+        st.session_state.query_results = []
+        for lookup in lookups:
+            try:
+                with span("app.lookup_wait"):
+                    result, error = lookup.result()
+                if error:
+                    answers.append(f"Error: {error}")
+                elif isinstance(result, dict):
+                    # Keep the rows out of the transcript; the tables are rendered below
+                    st.session_state.query_results.append(result)
+                    answers.append(summarize_query_result(result))
+                else:
+                    answers.append(result)
+            except Exception as e:
+                answers.append(f"Error: {str(e)}")
+            finally:
+                get_executor().forget(lookup.key)
+        full_response = "\n\n".join(answers)
+
+    # Display the response
+    message_placeholder.markdown(full_response or "_Stopped._")
+    st.caption(
+        f"Tokens: ~{token_usage['estimated_prompt_tokens']} estimated prompt"
+        + (f", {token_usage['prompt_tokens']} prompt + {token_usage['completion_tokens']} completion"
+           if "prompt_tokens" in token_usage else "")
+        + f" ({token_usage['turns_sent']} recent turns, {token_usage['turns_summarized']} summarized)"
+        + (f" · first token {token_usage['ttft_seconds']:.2f}s" if "ttft_seconds" in token_usage else "")
+        + f", total {token_usage['total_seconds']:.2f}s"
+        + (f" · {token_usage['document_excerpts']} document excerpts" if token_usage["document_excerpts"] else "")
+        + (" · cached response" if token_usage.get("cache_hit") else "")
+        + (" · stopped" if token_usage.get("stopped") else "")
+    )
+    add_message("assistant", full_response)
+
 # Chat handling and user prompt interaction
 if prompt := st.chat_input(f"Enter your prompt "):
-    st.session_state.messages.append({"role": "user", "content": prompt})
+    run_trace.label = "chat"
+    add_message("user", prompt)
+    try:
+        # Construct the conversation within the token budget: system prompt, summary of older turns, recent turns
+        with span("app.context"):
+            with db_pool.connection() as conn:
+                catalog = get_schema_catalog(conn)
+            system_message = SYSTEM_PROMPT.format(schema=catalog.describe())
+            excerpt_count = 0
+            if document_index is not None:
+                excerpts, excerpt_count = relevant_excerpts(document_index, prompt, k=RETRIEVAL_TOP_K,
+                                                            token_budget=RETRIEVAL_TOKEN_BUDGET)
+                if excerpts:
+                    system_message += f"\n\nRelevant excerpts from the uploaded document:\n{excerpts}"
+            conversation, token_usage = build_context(system_message, st.session_state.messages,
+                                                      budget=CONTEXT_TOKEN_BUDGET)
+            token_usage["document_excerpts"] = excerpt_count
+
+        # Start the reply as a background job; it is rendered (and collected) below
+        response_cache = get_response_cache()
+        cache_key = response_cache.make_key(OPENAI_MODEL, conversation, catalog.schema_version)
+        cached_response = None if bypass_cache else response_cache.get(cache_key)
+        create = get_openai().chat.completions.create if cached_response is None else None
+        chat_job = get_executor().submit(("chat", st.session_state.session_id, cache_key), complete_chat_turn,
+                                         create, response_cache, cache_key, cached_response, conversation,
+                                         bypass_cache=bypass_cache)
+        st.session_state.pending_turn = {"job": chat_job.key, "prompt": prompt, "token_usage": token_usage}
+
+    except Exception as e:
+        add_message("assistant", f"Error: {str(e)}")
+        with st.chat_message("user"):
+            st.markdown(prompt)
+        with st.chat_message("assistant"):
+            st.markdown(f"Error: {str(e)}")
+
+# Render the pending chat turn. A rerun while the reply is streaming (any interaction with the
+# page) picks the same job up again here, showing what has arrived so far.
+if pending_turn := st.session_state.get("pending_turn"):
     with st.chat_message("user"):
-        st.markdown(prompt)
+        st.markdown(pending_turn["prompt"])
 
     with st.chat_message("assistant"):
         message_placeholder = st.empty()
-        with message_placeholder:
-            st.markdown("**Generating response...**")
-            st.spinner("Thinking...")
-
-        try:
-            # Construct the conversation history as a list of messages
-            system_message = {"role": "system", "content": "You are a helpful assistant that can help with database queries."}
-            conversation = [{"role": "user", "content": prompt}]
-            conversation.extend(st.session_state.messages)  # Add the entire conversation history
-
-            # Request response from OpenAI's API
-            response = openai.chat.completions.create(
-                model=OPENAI_MODEL,
-                messages=conversation,
-                max_tokens=MAX_TOKENS
+        chat_job = get_executor().get(pending_turn["job"])
+        if chat_job is None:
+            # Finished too long ago to be collected (see jobs.JOB_RESULT_TTL)
+            del st.session_state.pending_turn
+            message_placeholder.markdown("Error: The response expired before it could be shown. Please ask again.")
+        else:
+            stop_placeholder = st.empty()
+            if not chat_job.done() and stop_placeholder.button("Stop", key="stop_response"):
+                chat_job.cancel()
+            while not chat_job.wait(JOB_POLL_SECONDS):
+                message_placeholder.markdown((chat_job.progress or "**Generating response...**") + "▌")
+            stop_placeholder.empty()
+
+            del st.session_state.pending_turn
+            get_executor().forget(chat_job.key)
+            try:
+                finish_chat_turn(chat_job, pending_turn["token_usage"], message_placeholder)
+            except Exception as e:
+                add_message("assistant", f"Error: {str(e)}")
+                message_placeholder.markdown(f"Error: {str(e)}")
+
+# Show the latest lookup results, one page at a time
+with span("app.render_results"):
+    for index, query_result in enumerate(st.session_state.get("query_results", [])):
+        render_query_result(query_result, index)
+
+# Index advisor: recommend indexes for columns hot with exact lookups (verified with EXPLAIN QUERY PLAN)
+if show_index_advisor or AUTO_CREATE_INDEXES:
+    index_report = advisor_report(DB_PATH)
+    if AUTO_CREATE_INDEXES and index_report["recommendations"]:
+        apply_index_recommendations(index_report["recommendations"])
+    if show_index_advisor:
+        with st.sidebar:
+            st.subheader("Index advisor")
+            if index_report["lookups"]:
+                st.dataframe(pd.DataFrame(index_report["lookups"]).round(2))
+            st.caption(
+                f"Lookups using an index / scanning: {index_report['before']['index']} / "
+                f"{index_report['before']['scans']} recorded, {index_report['after']['index']} / "
+                f"{index_report['after']['scans']} with the recommended indexes"
             )
-
-            full_response = response.choices[0].message.content
-
-            # Check if the response contains a database query instruction
-            if "query:" in full_response:
-                try:
-                    # Extract the query details (e.g., table and column) from the response
-                    query_details = full_response.split("query:")[1].strip()
-
-                    # Ensure we split into 3 components: table_name, column_name, and search_value
-                    query_parts = query_details.split("|")
-                    if len(query_parts) == 3:
-                        table_name, column_name, search_value = [part.strip() for part in query_parts]
-
-                        # Execute the dynamic query
-                        result, error = execute_dynamic_query(conn, table_name, column_name, search_value)
-                        if error:
-                            full_response = f"Error: {error}"
-                        else:
-                            full_response = f"Query results:\n{result}"
-                    else:
-                        full_response = "Error: Invalid query format returned by the model."
-
-                except Exception as e:
-                    full_response = f"Error: {str(e)}"
-
-            # Display the response
-            message_placeholder.markdown(full_response)
-
-        except Exception as e:
-            st.session_state.messages.append({"role": "assistant", "content": f"Error: {str(e)}"})
-            message_placeholder.markdown(f"Error: {str(e)}")
-
-# Save the updated chat history to the file
-save_chat_history(st.session_state.messages)
+            for recommendation in index_report["recommendations"]:
+                st.code(recommendation["sql"] + ";\n-- " + "\n-- ".join(recommendation["plan"]), language="sql")
+            if index_report["recommendations"] and st.button("Create recommended indexes"):
+                apply_index_recommendations(index_report["recommendations"])
+                st.rerun()
+
+# Close this run's trace: update the session's rolling percentiles and write the exports
+record("app.script", time.time() - run_trace.started_at)
+finish_trace(run_trace, st.session_state.perf_stats, jsonl_path=METRICS_JSONL_PATH, prom_path=METRICS_PROM_PATH)
+
+# Sidebar performance panel: stage breakdown of the last runs and rolling percentiles for this session
+if show_perf_panel:
+    with st.sidebar:
+        st.subheader("Performance")
+        recent_runs = list(st.session_state.perf_stats.recent)[-PERF_PANEL_RUNS:]
+        st.dataframe(pd.DataFrame(
+            [{"run": label or "rerun", **{stage: seconds * 1000 for stage, seconds in stages.items()}}
+             for label, _, stages in reversed(recent_runs)]
+        ).round(1))
+        st.caption("Milliseconds per stage, latest run first")
+        percentiles = pd.DataFrame.from_dict(st.session_state.perf_stats.percentiles(), orient="index")
+        st.dataframe((percentiles.drop(columns="count") * 1000).round(1).assign(count=percentiles["count"]))
+        st.caption("Rolling percentiles per stage for this session, in milliseconds")
+
+# Wait for an upload still being parsed, then rerun to show it. Updating the status lets
+# any interaction interrupt the wait; the parse job itself keeps running.
+if upload_job is not None:
+    while not upload_job.wait(JOB_POLL_SECONDS):
+        upload_status.info(f"Parsing the uploaded file... ({time.time() - upload_job.submitted_at:.0f}s)")
+    st.rerun()
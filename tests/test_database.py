@@ -0,0 +1,193 @@
+import http.server
+import os
+import shutil
+import sqlite3
+import threading
+import time
+
+import pytest
+
+from database import ConnectionPool, fetch_database, fetch_query_page
+
+CHINOOK_DB = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "chinook.db")
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    path = str(tmp_path / "database.db")
+    shutil.copyfile(CHINOOK_DB, path)
+    return path
+
+
+def test_pool_reuses_connections(db_path):
+    pool = ConnectionPool(db_path, max_size=2)
+    with pool.connection() as first:
+        pass
+    with pool.connection() as second:
+        assert second is first
+    assert pool.stats()["size"] == 1
+
+
+def test_reset_wakes_waiter_on_full_pool(db_path):
+    pool = ConnectionPool(db_path, max_size=1, timeout=5)
+    holder = pool.connection()
+    held = holder.__enter__()
+    acquired = []
+
+    def wait_for_connection():
+        with pool.connection() as conn:
+            acquired.append(conn)
+
+    waiter = threading.Thread(target=wait_for_connection)
+    waiter.start()
+    time.sleep(0.1)  # Let the waiter block on the exhausted pool
+    pool.reset()
+    started = time.perf_counter()
+    holder.__exit__(None, None, None)  # Retired, closed; its slot goes to the waiter
+    waiter.join(timeout=5)
+
+    assert acquired and acquired[0] is not held
+    assert time.perf_counter() - started < 1
+    assert pool.stats()["size"] == 1
+
+
+def test_reset_never_leaves_retired_connection_idle(db_path):
+    pool = ConnectionPool(db_path, max_size=4)
+    with pool.connection() as old:
+        pool.reset()
+    with pool.connection() as new:
+        assert new is not old
+    assert pool.stats()["idle"] == 1
+
+
+def test_pool_times_out_when_exhausted(db_path):
+    pool = ConnectionPool(db_path, max_size=1, timeout=0.2)
+    with pool.connection():
+        with pytest.raises(sqlite3.OperationalError, match="Timed out"):
+            with pool.connection():
+                pass
+    assert pool.stats()["waits"] == 1
+
+
+class _StandIn:
+    """Local stand-in for the database's HTTP host, counting requests and body bytes sent."""
+
+    def __init__(self, content, etag='"v1"', validators=True):
+        self.content = content
+        self.etag = etag
+        self.validators = validators
+        self.requests = 0
+        self.bytes_sent = 0
+
+    def handler(self):
+        stand_in = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                stand_in.requests += 1
+                if stand_in.validators and self.headers.get("If-None-Match") == stand_in.etag:
+                    self.send_response(304)
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header("Content-Length", str(len(stand_in.content)))
+                if stand_in.validators:
+                    self.send_header("ETag", stand_in.etag)
+                    self.send_header("Last-Modified", "Mon, 01 Jan 2024 00:00:00 GMT")
+                self.end_headers()
+                self.wfile.write(stand_in.content)
+                stand_in.bytes_sent += len(stand_in.content)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+
+@pytest.fixture
+def stand_in():
+    with open(CHINOOK_DB, "rb") as f:
+        stand_in = _StandIn(f.read())
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), stand_in.handler())
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    stand_in.url = f"http://127.0.0.1:{server.server_address[1]}/chinook.db"
+    yield stand_in
+    server.shutdown()
+    server.server_close()
+
+
+def test_fetch_downloads_once_then_skips_network(stand_in, tmp_path):
+    db_path = str(tmp_path / "database.db")
+    assert fetch_database(stand_in.url, db_path) == ("updated", None)
+    assert stand_in.bytes_sent == len(stand_in.content)
+    with open(db_path, "rb") as f:
+        assert f.read() == stand_in.content
+
+    for _ in range(3):  # Later reruns
+        assert fetch_database(stand_in.url, db_path) == ("fresh", None)
+    assert stand_in.requests == 1
+    assert stand_in.bytes_sent == len(stand_in.content)
+
+
+def test_stale_copy_revalidates_without_transfer(stand_in, tmp_path):
+    db_path = str(tmp_path / "database.db")
+    fetch_database(stand_in.url, db_path)
+    sent = stand_in.bytes_sent
+    for _ in range(3):
+        assert fetch_database(stand_in.url, db_path, max_age=0) == ("not-modified", None)
+    assert stand_in.requests == 4
+    assert stand_in.bytes_sent == sent  # Only 304s, no body
+
+
+def test_changed_content_is_swapped_in(stand_in, tmp_path):
+    db_path = str(tmp_path / "database.db")
+    fetch_database(stand_in.url, db_path)
+    stand_in.content = stand_in.content + b"\0" * 1024
+    stand_in.etag = '"v2"'
+    assert fetch_database(stand_in.url, db_path, max_age=0) == ("updated", None)
+    with open(db_path, "rb") as f:
+        assert f.read() == stand_in.content
+    assert sorted(os.listdir(tmp_path)) == ["database.db", "database.db.meta.json"]  # No temp files left
+
+
+def test_same_content_without_validators_keeps_file(stand_in, tmp_path):
+    stand_in.validators = False
+    db_path = str(tmp_path / "database.db")
+    fetch_database(stand_in.url, db_path)
+    inode = os.stat(db_path).st_ino
+    assert fetch_database(stand_in.url, db_path, max_age=0) == ("not-modified", None)
+    assert os.stat(db_path).st_ino == inode  # Content hash matched: the file wasn't replaced
+
+
+def test_unreachable_host_keeps_serving_local_copy(stand_in, tmp_path):
+    db_path = str(tmp_path / "database.db")
+    fetch_database(stand_in.url, db_path)
+    unreachable = "http://127.0.0.1:9/chinook.db"
+    assert fetch_database(unreachable, db_path, max_age=0, timeout=2) == ("fresh", None)
+    status, error = fetch_database(unreachable, str(tmp_path / "other.db"), timeout=2)
+    assert status is None and "Error downloading database" in error
+
+
+def test_query_pages_follow_each_other(db_path):
+    pool = ConnectionPool(db_path)
+    with pool.connection() as conn:
+        expected = conn.execute("SELECT rowid FROM tracks WHERE Name LIKE '%love%' ORDER BY rowid").fetchall()
+        rowids = []
+        after_rowid = None
+        while True:
+            page, error = fetch_query_page(conn, "tracks", "Name", "love", after_rowid=after_rowid, page_size=20)
+            assert error is None
+            rowids.extend(row[0] for row in page["rows"])  # TrackId is the rowid
+            after_rowid = page["last_rowid"]
+            if not page["has_more"]:
+                break
+    assert rowids == [rowid for rowid, in expected]
+    assert len(rowids) > 20
+
+
+def test_query_page_rejects_unknown_column(db_path):
+    pool = ConnectionPool(db_path)
+    with pool.connection() as conn:
+        page, error = fetch_query_page(conn, "tracks", "Nope", "x")
+    assert page is None and "Nope" in error
@@ -0,0 +1,145 @@
+import gc
+import io
+import os
+import pickle
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from benchmarks.stubs import StubUpload
+from file_handlers import (ParsedUploadCache, StagedTable, _UploadedBytes, get_parser, handle_uploaded_file,
+                           load_image_array, load_tabular_upload, parse_upload_bytes, supported_extensions)
+
+
+@pytest.mark.parametrize("mime_type", ["text/csv", "application/vnd.ms-excel", "application/octet-stream"])
+def test_csv_parsed_as_csv_whatever_the_browser_calls_it(mime_type):
+    (data, columns), _ = parse_upload_bytes(b"a,b\n1,2\n3,4\n", "table.csv", mime_type)
+    assert columns == ["a", "b"]
+    assert data["b"].tolist() == [2, 4]
+
+
+def test_mime_type_decides_when_specific():
+    upload = _UploadedBytes(b"{}", "export.txt", "application/json")
+    assert get_parser(upload) is get_parser(_UploadedBytes(b"{}", "data.json", "application/json"))
+
+
+def test_legacy_xls_is_not_offered():
+    assert "xls" not in supported_extensions()
+    assert get_parser(_UploadedBytes(b"", "book.xls", "application/vnd.ms-excel")) is None
+
+
+def _pdf_bytes(pages=3):
+    import pymupdf
+
+    doc = pymupdf.open()
+    for i in range(pages):
+        doc.new_page().insert_text((72, 72), f"page {i}")
+    return doc.tobytes()
+
+
+def test_cached_pdf_renders_into_each_sessions_dir(tmp_path):
+    cache = ParsedUploadCache()
+    session_a, session_b = str(tmp_path / "a"), str(tmp_path / "b")
+    upload = StubUpload(_pdf_bytes(), "doc.pdf", "application/pdf")
+    handle_uploaded_file(upload, cache_dir=session_a, cache=cache)
+    data, _ = handle_uploaded_file(upload, cache_dir=session_b, cache=cache)
+    assert cache.stats()["hits"] == 1
+    assert os.path.dirname(data["page_images"][0]) == session_b
+    assert os.listdir(session_a) == []
+
+
+def test_spill_file_removed_once_loaded_back(tmp_path):
+    cache = ParsedUploadCache(max_bytes=1, spill_dir=str(tmp_path))
+    cache.put("first", (pd.DataFrame({"a": range(100)}), ["a"]))
+    cache.put("second", (pd.DataFrame({"a": range(100)}), ["a"]))  # Evicts and spills "first"
+    assert len(os.listdir(cache.spill_dir)) == 1
+    data, _ = cache.get("first")
+    assert data["a"].tolist() == list(range(100))
+    assert "first" not in " ".join(os.listdir(cache.spill_dir))
+    cache.clear()
+    assert os.listdir(cache.spill_dir) == []
+
+
+def test_stored_pdf_deleted_with_its_artifact(tmp_path):
+    (data, _), _ = parse_upload_bytes(_pdf_bytes(), "doc.pdf", "application/pdf", str(tmp_path))
+    pdf_path = data["page_images"].pdf_path
+    assert os.path.exists(pdf_path)
+    del data
+    gc.collect()
+    assert not os.path.exists(pdf_path)
+
+
+def test_small_json_lines_upload():
+    (data, columns), _ = parse_upload_bytes(b'{"a": 1, "b": "x"}\n{"a": 2, "b": "y"}\n', "rows.json",
+                                            "application/json")
+    assert columns == ["a", "b"]
+    assert data["a"].tolist() == [1, 2]
+
+
+def test_small_json_document_upload():
+    (data, _), _ = parse_upload_bytes(b'{\n  "a": [1, 2],\n  "b": ["x", "y"]\n}\n', "cols.json", "application/json")
+    assert data["b"].tolist() == ["x", "y"]
+
+
+def test_staged_table_file_deleted_with_table(tmp_path):
+    upload = StubUpload(b"a,b\n" + b"1,x\n" * 1000, "big.csv", "text/csv")
+    table = load_tabular_upload(upload, "csv", str(tmp_path), large_file_bytes=0)
+    assert isinstance(table, StagedTable) and len(table) == 1000
+    path = table.path
+    assert os.path.exists(path)
+    del table
+    gc.collect()
+    assert not os.path.exists(path)
+
+
+def test_evicted_staged_table_not_spilled_and_deleted(tmp_path):
+    cache = ParsedUploadCache(spill_dir=str(tmp_path / "spill"), max_disk_bytes=1)
+    paths = []
+    for name in ("first", "second"):
+        table = load_tabular_upload(StubUpload(b"a\n" + b"1\n" * 1000, "big.csv", "text/csv"), "csv",
+                                    str(tmp_path), large_file_bytes=0)
+        paths.append(table.path)
+        cache.put(name, (table, table.columns))
+    del table
+    gc.collect()
+    assert not os.path.exists(paths[0]) and os.path.exists(paths[1])
+    assert os.listdir(cache.spill_dir) == []
+    assert cache.get("first") is None
+
+
+def test_pickled_staged_table_owns_its_file(tmp_path):
+    # A large upload parsed in a worker process comes back pickled; the copy takes the file over
+    table = load_tabular_upload(StubUpload(b"a\n" + b"1\n" * 10, "big.csv", "text/csv"), "csv",
+                                str(tmp_path), large_file_bytes=0)
+    copy = pickle.loads(pickle.dumps(table))
+    del table
+    gc.collect()
+    assert copy.head(3)["a"].tolist() == [1, 1, 1]
+    path = copy.path
+    del copy
+    gc.collect()
+    assert not os.path.exists(path)
+
+
+@pytest.mark.parametrize("mode", ["1", "L", "P", "I;16", "RGB", "RGBA"])
+def test_large_image_downsampled_in_any_mode(mode):
+    from PIL import Image
+
+    gradient = np.tile(np.linspace(0, 255, 300, dtype=np.uint8), (200, 1))
+    img = Image.fromarray(np.stack([gradient, gradient[::-1], np.full_like(gradient, 128)], axis=-1))
+    if mode == "P":
+        img = img.quantize(64)
+    elif mode == "I;16":
+        img = Image.fromarray(gradient.astype(np.uint16))
+    else:
+        img = img.convert(mode)
+    buffer = io.BytesIO()
+    img.save(buffer, format="PNG")
+    buffer.seek(0)
+
+    array = load_image_array(buffer, max_pixels=10_000)
+    assert array.dtype == np.uint8 and array.shape == (67, 100, 3)
+    # Downsampling averages the full-resolution pixels, it doesn't mix palette indices
+    expected = np.asarray(img.convert("RGB"), dtype=np.float64).mean(axis=(0, 1))
+    assert np.allclose(array.mean(axis=(0, 1)), expected, atol=3 if mode != "1" else 40)
@@ -0,0 +1,92 @@
+import threading
+import time
+
+import pytest
+
+from file_handlers import parse_upload_bytes
+from jobs import JOB_START_METHOD, JobExecutor, JobQueueFull, cancel_requested
+
+
+def blocker():
+    """A job function that runs until the returned event is set."""
+    release = threading.Event()
+    return release, lambda: release.wait(5)
+
+
+def test_same_key_returns_running_job():
+    executor = JobExecutor(thread_workers=1)
+    release, block = blocker()
+    job = executor.submit("key", block)
+    assert executor.submit("key", block) is job
+    release.set()
+    assert job.wait(5)
+    assert executor.submit("key", block) is job  # Finished but not yet collected
+    executor.forget("key")
+    assert executor.submit("key", lambda: 1) is not job
+    assert executor.stats()["deduplicated"] == 2
+
+
+def test_full_queue_refuses_jobs():
+    executor = JobExecutor(thread_workers=1, max_pending=2)
+    release, block = blocker()
+    executor.submit(None, block)
+    executor.submit(None, block)
+    with pytest.raises(JobQueueFull):
+        executor.submit(None, block)
+    assert executor.stats()["rejected"] == 1
+    release.set()
+    time.sleep(0.1)
+    assert executor.submit(None, lambda: 1).wait(5)
+
+
+def test_cancelled_queued_job_never_runs():
+    executor = JobExecutor(thread_workers=1)
+    release, block = blocker()
+    executor.submit(None, block)
+    ran = []
+    queued = executor.submit("queued", ran.append, 1)
+    assert queued.cancel()
+    assert queued.status() == "cancelled"
+    release.set()
+    time.sleep(0.1)
+    assert ran == []
+    assert executor.submit("queued", ran.append, 2) is not queued  # A cancelled job isn't handed out again
+    assert executor.stats()["pending_threads"] <= 1
+
+
+def test_running_job_stops_cooperatively():
+    executor = JobExecutor()
+    started = threading.Event()
+
+    def work():
+        started.set()
+        while not cancel_requested():
+            time.sleep(0.01)
+        return "stopped"
+
+    job = executor.submit("work", work)
+    assert started.wait(5)
+    assert not job.cancel()  # Already running: only the request is recorded
+    assert job.wait(5)
+    assert job.result() == "stopped"
+    assert not cancel_requested()  # Outside a job there is nothing to cancel
+
+
+def test_uncollected_results_expire():
+    executor = JobExecutor(result_ttl=0.05)
+    job = executor.submit("old", lambda: 1)
+    assert job.wait(5)
+    time.sleep(0.1)
+    executor.submit(None, lambda: 2)  # Expiry runs on submit
+    assert executor.get("old") is None
+
+
+def test_process_job_runs_in_non_forked_worker():
+    executor = JobExecutor(process_workers=1)
+    try:
+        job = executor.submit("parse", parse_upload_bytes, b"a,b\n1,2\n", "t.csv", "text/csv", kind="process")
+        (data, columns), seconds = job.result(timeout=60)
+        assert columns == ["a", "b"] and seconds >= 0
+        assert executor.process_pool._mp_context.get_start_method() == JOB_START_METHOD != "fork"
+    finally:
+        executor.process_pool.shutdown()
@@ -0,0 +1,146 @@
+import time
+
+import pytest
+
+from benchmarks.stubs import stub_completion
+import llm
+from llm import DirectiveScanner, ResponseCache, find_directives, stream_completion
+
+REPLY = "Let me look that up.\nquery: tracks|Name|Love\nquery: customers|Country|Brazil\nDone."
+
+
+def slow(create, first_token_delay, chunk_delay):
+    """Wrap a stub so it waits before its first chunk and between the others, like a real endpoint."""
+    def slow_create(**kwargs):
+        for i, chunk in enumerate(create(**kwargs)):
+            time.sleep(first_token_delay if i == 0 else chunk_delay)
+            yield chunk
+    return slow_create
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 7, 64])
+def test_directives_split_across_chunks(chunk_size):
+    latest = {"text": ""}
+    seen_at = []
+
+    def on_directive(directive):
+        seen_at.append((directive, len(latest["text"])))
+
+    text, _ = stream_completion(stub_completion(REPLY, chunk_size=chunk_size),
+                                on_text=lambda text: latest.update(text=text), on_directive=on_directive)
+    assert text == REPLY
+    assert [directive for directive, _ in seen_at] == ["tracks|Name|Love", "customers|Country|Brazil"]
+    # Each lookup starts as soon as its line is complete, not at the end of the stream
+    first_line_end = REPLY.index("Love\n") + len("Love\n")
+    assert seen_at[0][1] < first_line_end + chunk_size
+
+
+def test_final_line_without_trailing_newline():
+    directives = []
+    stream_completion(stub_completion("Checking.\nquery: customers|Country|Brazil", chunk_size=5),
+                      on_directive=directives.append)
+    assert directives == ["customers|Country|Brazil"]
+
+
+def test_several_directives_on_one_line():
+    assert find_directives("query: a|b|c query: d|e|f\nquery: g|h|i") == ["a|b|c", "d|e|f", "g|h|i"]
+
+
+def test_scanner_holds_back_incomplete_line():
+    scanner = DirectiveScanner()
+    assert scanner.feed("query: tracks|Na") == []
+    assert scanner.feed("me|Love\nquery: x") == ["tracks|Name|Love"]
+    assert scanner.finish() == ["x"]
+
+
+def test_on_text_receives_text_so_far():
+    texts = []
+    stream_completion(stub_completion("abcdefgh", chunk_size=3), on_text=texts.append)
+    assert texts == ["abc", "abcdef", "abcdefgh"]
+
+
+def test_latency_and_usage_fields():
+    chunk_delay = 0.02
+    create = slow(stub_completion(REPLY, chunk_size=16), first_token_delay=0.1, chunk_delay=chunk_delay)
+    _, stats = stream_completion(create)
+    chunks = -(-len(REPLY) // 16)
+    assert stats["ttft_seconds"] >= 0.1
+    assert stats["total_seconds"] >= stats["ttft_seconds"] + (chunks - 1) * chunk_delay
+    assert stats["prompt_tokens"] == 0 and stats["completion_tokens"] == 0
+    assert "stopped" not in stats
+
+
+def test_request_is_streamed_with_usage():
+    requests = []
+
+    def create(**kwargs):
+        requests.append(kwargs)
+        return stub_completion("hi")(**kwargs)
+
+    stream_completion(create, model="stub", messages=[])
+    assert requests == [{"stream": True, "stream_options": {"include_usage": True}, "model": "stub", "messages": []}]
+
+
+def test_stopped_stream_does_not_dispatch_partial_directive():
+    create = stub_completion("query: tracks|Name|Love\nquery: customers|Country|Brazil\n", chunk_size=4)
+    latest = {"text": ""}
+    directives = []
+
+    text, stats = stream_completion(
+        create,
+        on_text=lambda text: latest.update(text=text),
+        on_directive=directives.append,
+        should_stop=lambda: "|Bra" in latest["text"],  # Stop inside the second directive
+    )
+    assert stats["stopped"]
+    assert text.endswith("|Bra")
+    assert directives == ["tracks|Name|Love"]
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Controllable time.time() for the response cache."""
+    now = {"t": 1_000_000.0}
+    monkeypatch.setattr(llm.time, "time", lambda: now["t"])
+    return now
+
+
+def test_response_cache_expires_after_ttl(tmp_path, clock):
+    cache = ResponseCache(str(tmp_path / "cache.db"), ttl=60)
+    cache.put("k", "answer")
+    clock["t"] += 59
+    assert cache.get("k") == "answer"
+    clock["t"] += 2
+    assert cache.get("k") is None
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert cache.stats()["entries"] == 0
+
+
+def test_response_cache_evicts_least_recently_used(tmp_path, clock):
+    cache = ResponseCache(str(tmp_path / "cache.db"), max_entries=2)
+    for key in ("a", "b"):
+        cache.put(key, key)
+        clock["t"] += 1
+    assert cache.get("a") == "a"  # "b" is now the least recently used
+    clock["t"] += 1
+    cache.put("c", "c")
+    assert cache.get("b") is None
+    assert cache.get("a") == "a" and cache.get("c") == "c"
+    assert cache.evictions == 1
+
+
+def test_response_cache_byte_cap(tmp_path, clock):
+    cache = ResponseCache(str(tmp_path / "cache.db"), max_bytes=250)
+    for key in ("a", "b", "c"):
+        cache.put(key, key * 100)
+        clock["t"] += 1
+    assert cache.get("a") is None
+    assert cache.get("b") == "b" * 100 and cache.get("c") == "c" * 100
+    assert cache.stats()["bytes"] <= 250
+
+
+def test_response_cache_key_ignores_prompt_formatting():
+    context = [{"role": "system", "content": "schema"}]
+    key = ResponseCache.make_key("model", context + [{"role": "user", "content": "Brazil customers?"}], 1)
+    assert key == ResponseCache.make_key("model", context + [{"role": "user", "content": "  brazil   CUSTOMERS"}], 1)
+    assert key != ResponseCache.make_key("model", context + [{"role": "user", "content": "Brazil customers?"}], 2)
@@ -0,0 +1,74 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import range_index
+from benchmarks.stubs import StubUpload
+from file_handlers import load_tabular_upload
+from range_index import ColumnRangeIndex, get_range_index
+
+ROWS = 1000
+# Short ranges take the direct bincount path, long ones the binary searches; the last ones run past the end
+RANGES = [(0, ROWS), (0, 0), (5, 6), (10, 60), (100, 900), (250, 251), (990, 5000), (ROWS, ROWS + 10)]
+
+
+def make_frame():
+    rng = np.random.default_rng(0)
+    values = rng.normal(10, 3, ROWS)
+    values[rng.random(ROWS) < 0.2] = np.nan
+    values[300:400] = np.nan  # A range with no values at all
+    return pd.DataFrame({
+        "city": rng.choice([f"city {i}" for i in range(120)], ROWS),  # More categories than short ranges have rows
+        "grade": rng.choice(list("ABCD"), ROWS),
+        "value": values,
+    })
+
+
+@pytest.fixture(scope="module")
+def frame():
+    return make_frame()
+
+
+@pytest.fixture(params=["dataframe", "staged"])
+def data(request, frame, tmp_path_factory, monkeypatch):
+    if request.param == "dataframe":
+        return frame
+    # Staged like a large upload, and indexed in several chunks
+    monkeypatch.setattr(range_index, "INDEX_CHUNK_ROWS", 128)
+    upload = StubUpload(frame.to_csv(index=False).encode(), "data.csv", "text/csv")
+    return load_tabular_upload(upload, "csv", str(tmp_path_factory.mktemp("staged")), large_file_bytes=0)
+
+
+@pytest.mark.parametrize("start, end", RANGES)
+@pytest.mark.parametrize("column", ["city", "grade"])
+def test_value_counts_match_pandas(frame, data, column, start, end):
+    counts = get_range_index(data, column).value_counts(start, end)
+    expected = frame[column].iloc[start:end].value_counts()
+    assert counts.to_dict() == expected.to_dict()
+    assert list(counts) == sorted(counts, reverse=True)
+
+
+@pytest.mark.parametrize("start, end", RANGES)
+def test_range_means_skip_missing_values(frame, data, start, end):
+    index = get_range_index(data, "value")
+    assert index.is_numeric
+    mean = index.range_means([start], [end])[0]
+    expected = frame["value"].iloc[start:end].mean()
+    if np.isnan(expected):
+        assert np.isnan(mean)
+    else:
+        assert mean == pytest.approx(expected)
+
+
+def test_all_missing_range_mean_is_nan(frame):
+    index = ColumnRangeIndex.from_series(frame["value"])
+    assert np.isnan(index.range_means([300], [400])[0])
+    assert index.range_sums([300], [400])[0] == 0
+
+
+def test_chunked_build_matches_whole_series(frame):
+    series = frame["city"]
+    whole = ColumnRangeIndex.from_series(series)
+    chunked = ColumnRangeIndex.from_chunks(series.iloc[i:i + 64] for i in range(0, ROWS, 64))
+    for start, end in RANGES:
+        assert chunked.value_counts(start, end).to_dict() == whole.value_counts(start, end).to_dict()
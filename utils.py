@@ -1,23 +1,108 @@
 import json
-import os
+import sqlite3
+import threading
+import time
 import pandas as pd
+from range_index import ColumnRangeIndex
 
-CHAT_HISTORY_FILE = 'chat_history.json'
+# SQLite file holding every session's chat history, one row per message
+CHAT_HISTORY_DB = 'chat_history.db'
+HISTORY_LOAD_LIMIT = 50  # Most recent messages loaded when a session starts
+HISTORY_RETENTION = 500  # Messages kept per session when old history is compacted
+COMPACTION_INTERVAL = 600  # Seconds between background compactions
 
-def load_chat_history():
+_local = threading.local()
+_compactor_lock = threading.Lock()
+_compactor_started = False
+
+
+def _history_conn():
+    """Return this thread's connection to the history database, creating the schema on first use."""
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        # WAL lets readers run alongside a writer; busy_timeout makes concurrent writers queue up
+        conn = sqlite3.connect(CHAT_HISTORY_DB, timeout=10)
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("PRAGMA synchronous = NORMAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS messages ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, session_id TEXT NOT NULL, "
+            "message TEXT NOT NULL, created_at REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS messages_session ON messages (session_id, id)")
+        conn.commit()
+        _local.conn = conn
+        _start_compactor()
+    return conn
+
+
+def load_chat_history(session_id, limit=HISTORY_LOAD_LIMIT):
+    """Load the most recent `limit` messages of a session, oldest first."""
     try:
-        if os.path.exists(CHAT_HISTORY_FILE):
-            with open(CHAT_HISTORY_FILE, 'r') as file:
-                return json.load(file)
-        return []  # Return an empty list if the file doesn't exist
-    except json.JSONDecodeError as e:
-        return []  # Return an empty list if the file is corrupted
-
-def save_chat_history(messages):
-    with open(CHAT_HISTORY_FILE, 'w') as file:
-        json.dump(messages, file)
-
-def generate_chart_description(chart_type, data):
+        rows = _history_conn().execute(
+            "SELECT message FROM messages WHERE session_id = ? ORDER BY id DESC LIMIT ?",
+            (session_id, limit),
+        ).fetchall()
+        return [json.loads(row[0]) for row in reversed(rows)]
+    except (sqlite3.Error, json.JSONDecodeError):
+        return []  # Return an empty list if the store is unreadable
+
+
+def append_chat_message(session_id, message):
+    """Persist a single new message; earlier messages are never rewritten."""
+    conn = _history_conn()
+    with conn:
+        conn.execute(
+            "INSERT INTO messages (session_id, message, created_at) VALUES (?, ?, ?)",
+            (session_id, json.dumps(message), time.time()),
+        )
+
+
+def clear_chat_history(session_id):
+    conn = _history_conn()
+    with conn:
+        conn.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
+
+
+def compact_chat_history(retention=HISTORY_RETENTION):
+    """Drop all but the most recent `retention` messages of every session."""
+    conn = _history_conn()
+    with conn:
+        conn.execute(
+            "DELETE FROM messages WHERE id IN ("
+            " SELECT id FROM (SELECT id, ROW_NUMBER() OVER ("
+            "  PARTITION BY session_id ORDER BY id DESC) AS recency FROM messages)"
+            " WHERE recency > ?)",
+            (retention,),
+        )
+
+
+def _start_compactor():
+    global _compactor_started
+    with _compactor_lock:
+        if _compactor_started:
+            return
+        _compactor_started = True
+
+    def run():
+        while True:
+            time.sleep(COMPACTION_INTERVAL)
+            try:
+                compact_chat_history()
+            except sqlite3.Error as e:
+                print(f"Chat history compaction failed: {e}")
+
+    threading.Thread(target=run, name="chat-history-compactor", daemon=True).start()
+
+def generate_chart_description(chart_type, data, start_value=None, end_value=None):
+    """
+    Describe a chart in words. `data` is a Series of values by category, a one-row DataFrame,
+    or a ColumnRangeIndex, whose value counts over [start_value, end_value) are read from the
+    index instead of rescanning the rows.
+    """
+    if isinstance(data, ColumnRangeIndex):
+        data = data.value_counts(start_value, end_value)
+
     if isinstance(data, pd.Series):
         values = data.tolist()
         categories = data.index.tolist()
@@ -27,7 +112,7 @@ def generate_chart_description(chart_type, data):
 
     if chart_type == "pie":
         total = sum(values)
-        percentages = [f"{value:.1f}% ({value}/{total})" for value in values]
+        percentages = [f"{100 * value / total if total else 0:.1f}% ({value}/{total})" for value in values]
         description = f"Pie Chart: {', '.join([f'{category}: {percentage}' for category, percentage in zip(categories, percentages)])}"
     elif chart_type == "bar":
         description = f"Bar Chart: Values for categories: {', '.join([f'{category}: {value}' for category, value in zip(categories, values)])}"
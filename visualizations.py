@@ -1,56 +1,168 @@
 import pandas as pd
-import matplotlib.pyplot as plt
+import numpy as np
 import io
+import hashlib
+import threading
+from collections import OrderedDict
 import streamlit as st
+from file_handlers import StagedTable
+from metrics import span, timed
+from range_index import get_range_index
+from utils import generate_chart_description
+
+# Chart rendering settings
+CHART_FIGSIZE = (6.4, 4.8)  # Inches
+CHART_DPI = 100
+MIN_BAR_PIXELS = 4  # Narrower bars can't be told apart, so longer ranges are aggregated
+MAX_BARS = int(CHART_FIGSIZE[0] * CHART_DPI / MIN_BAR_PIXELS)
+MAX_TICK_LABELS = 20  # X-axis labels shown at most, whatever the number of bars
+MAX_PIE_SLICES = 12  # Smaller categories are merged into "Other"
+CHART_CACHE_SIZE = 128  # Rendered PNGs kept in memory
+
+_chart_cache = OrderedDict()
+_chart_cache_lock = threading.Lock()
+
+
+def data_fingerprint(*series):
+    """Hash the values and index of the given Series (the data a chart is drawn from)."""
+    digest = hashlib.sha256()
+    for s in series:
+        digest.update(pd.util.hash_pandas_object(s, index=True).to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+def render_chart_png(key, draw):
+    """
+    Return the PNG bytes of a chart, rendering it with `draw(fig)` only if `key` isn't cached.
+    Figures are built without pyplot, so nothing is left registered (and leaking) after rendering,
+    and no GUI backend is ever involved. matplotlib itself is only imported for the first chart.
+    """
+    key = hashlib.sha256(repr(key).encode("utf-8")).hexdigest()
+    with _chart_cache_lock:
+        png = _chart_cache.get(key)
+        if png is not None:
+            _chart_cache.move_to_end(key)
+            return png
+
+    from matplotlib.figure import Figure
+
+    fig = Figure(figsize=CHART_FIGSIZE, dpi=CHART_DPI)
+    try:
+        with span("chart.render"):
+            draw(fig)
+            buffer = io.BytesIO()
+            fig.savefig(buffer, format="png", bbox_inches="tight")
+            png = buffer.getvalue()
+    finally:
+        fig.clear()
+
+    with _chart_cache_lock:
+        _chart_cache[key] = png
+        while len(_chart_cache) > CHART_CACHE_SIZE:
+            _chart_cache.popitem(last=False)
+    return png
+
+
+def limit_pie_slices(value_counts, max_slices=MAX_PIE_SLICES):
+    """Keep the largest categories and merge the rest into a single "Other" slice."""
+    if len(value_counts) <= max_slices:
+        return value_counts
+    value_counts = value_counts.sort_values(ascending=False)
+    top = value_counts.iloc[:max_slices - 1]
+    other = pd.Series([value_counts.iloc[max_slices - 1:].sum()], index=["Other"])
+    return pd.concat([top, other])
+
+
+def bucket_bounds(start_value, end_value, max_bars=MAX_BARS):
+    """Split rows [start_value, end_value) into at most `max_bars` consecutive buckets; returns (starts, ends)."""
+    count = max(end_value - start_value, 0)
+    buckets = min(count, max_bars)
+    ends = start_value + (np.arange(1, buckets + 1) * count) // max(buckets, 1)
+    starts = np.concatenate(([start_value], ends[:-1]))
+    return starts, ends
+
+
+def take_rows(data, column, positions):
+    """Values of `column` at the given row positions."""
+    if isinstance(data, StagedTable):
+        return data.take(column, positions)
+    return data[column].iloc[positions]
+
+
+def aggregate_bars(data, x_column, y_column, start_value, end_value, max_bars=MAX_BARS):
+    """
+    Merge consecutive bars into at most `max_bars` buckets (mean of y, labelled by the x range),
+    for ranges with more bars than the chart can show apart. Means come from the y column's
+    prefix sums and only the x values at bucket edges are read, so the range is never scanned.
+    """
+    starts, ends = bucket_bounds(start_value, end_value, max_bars)
+    means = get_range_index(data, y_column).range_means(starts, ends)
+    edges = take_rows(data, x_column, np.concatenate((starts, ends - 1))).tolist()
+    labels = [f"{first}–{last}" for first, last in zip(edges[:len(starts)], edges[len(starts):])]
+    return pd.Series(labels, name=x_column), pd.Series(means, name=y_column)
+
+def select_range(data, columns, start_value, end_value):
+    """
+    Return rows [start_value, end_value) of the given columns.
+    Staged (out-of-core) uploads only read those rows from disk.
+    """
+    if isinstance(data, StagedTable):
+        return data.slice(columns, start_value, end_value)
+    return data[columns].iloc[start_value:end_value]
 
 def preview_uploaded_file(data, num_rows=5):
     """
     Display the first few rows of the uploaded data to give the user a preview.
     
     Args:
-        data (pd.DataFrame): The uploaded dataset to preview.
+        data (pd.DataFrame or StagedTable): The uploaded dataset to preview.
         num_rows (int): The number of rows to preview.
     """
     st.write("Dataset preview:")
     st.dataframe(data.head(num_rows))
 
+@timed("chart.pie")
 def generate_pie_chart(data, column_name, start_value, end_value):
     """
     Generate a pie chart based on a selected column from the dataset.
     Only the data in the range [start_value, end_value] will be visualized.
 
     Args:
-        data (pd.DataFrame): The dataset.
+        data (pd.DataFrame or StagedTable): The dataset.
         column_name (str): The column name for the Pie Chart.
         start_value (int): The starting index for the data range.
         end_value (int): The ending index for the data range.
     """
-    # Slice the data to get the selected range
-    selected_data = data[column_name].iloc[start_value:end_value]
-    
-    # Generate value counts (for pie chart)
-    value_counts = selected_data.value_counts()
+    # Count the values in the selected range from the column's precomputed index (built on first use)
+    range_index = get_range_index(data, column_name)
+
+    # Generate value counts (for pie chart), merging small categories
+    value_counts = limit_pie_slices(range_index.value_counts(start_value, end_value))
 
     # Create the pie chart
-    fig, ax = plt.subplots()
-    ax.pie(value_counts, labels=value_counts.index, autopct='%1.1f%%', startangle=90)
-    ax.axis('equal')  # Equal aspect ratio ensures that pie is drawn as a circle.
+    def draw(fig):
+        ax = fig.subplots()
+        ax.pie(value_counts, labels=value_counts.index, autopct='%1.1f%%', startangle=90)
+        ax.axis('equal')  # Equal aspect ratio ensures that pie is drawn as a circle.
 
-    # Display the pie chart in Streamlit
-    st.pyplot(fig)
+    # Display the pie chart in Streamlit (re-rendered only if this exact chart isn't cached)
+    key = ("pie", column_name, start_value, end_value, data_fingerprint(value_counts))
+    st.image(render_chart_png(key, draw))
+    st.caption(generate_chart_description("pie", range_index, start_value, end_value))
 
+@timed("chart.bar")
 def generate_bar_chart(data, x_column, y_column, start_value, end_value, start_y_value, end_y_value):
     """ 
     Generate a bar chart based on selected columns and range of data for both axes.
     
     Args:
-        data (pd.DataFrame): The dataset.
+        data (pd.DataFrame or StagedTable): The dataset.
         x_column (str): The column for the X-axis.
         y_column (str): The column for the Y-axis.
         start_value (int): The starting index for the range.
         end_value (int): The ending index for the range.
     """ 
-    if not isinstance(data, pd.DataFrame): 
+    if not isinstance(data, (pd.DataFrame, StagedTable)): 
         st.error("The uploaded file is not a valid DataFrame.") 
         return 
     
@@ -59,53 +171,34 @@ def generate_bar_chart(data, x_column, y_column, start_value, end_value, start_y
         st.error(f"Columns {x_column} and {y_column} not found in the dataset.") 
         return 
     
-    # Slice the data to get the selected range for both X and Y axes 
-    selected_data_x = data[x_column].iloc[start_value:end_value] 
-    selected_data_y = data[y_column].iloc[start_value:end_value] 
+    if end_value - start_value > MAX_BARS and get_range_index(data, y_column).is_numeric:
+        # More bars than can be told apart on screen: aggregate them from the prefix-sum index
+        selected_data_x, selected_data_y = aggregate_bars(data, x_column, y_column, start_value, end_value)
+    else:
+        # Slice the data to get the selected range for both X and Y axes 
+        selected_data = select_range(data, list(dict.fromkeys([x_column, y_column])), start_value, end_value)
+        selected_data_x = selected_data[x_column]
+        selected_data_y = selected_data[y_column]
 
     # Create the bar chart
-    fig, ax = plt.subplots()
-    ax.bar(selected_data_x, selected_data_y)
+    def draw(fig):
+        from matplotlib.ticker import MaxNLocator
 
-    # Rotate the x-axis labels to prevent clutter
-    plt.xticks(rotation=45, ha='right')
+        ax = fig.subplots()
+        ax.bar(selected_data_x, selected_data_y)
 
-    # Set chart labels and title
-    ax.set_xlabel(x_column)
-    ax.set_ylabel(y_column)
-    ax.set_title(f"Bar Chart: {y_column} vs {x_column}")
+        # Thin out and rotate the x-axis labels to prevent clutter
+        if len(selected_data_x) > MAX_TICK_LABELS:
+            ax.xaxis.set_major_locator(MaxNLocator(MAX_TICK_LABELS, integer=True))
+        ax.tick_params(axis='x', labelrotation=45)
+        for label in ax.get_xticklabels():
+            label.set_horizontalalignment('right')
 
-    # Display the bar chart in Streamlit
-    st.pyplot(fig)
+        # Set chart labels and title
+        ax.set_xlabel(x_column)
+        ax.set_ylabel(y_column)
+        ax.set_title(f"Bar Chart: {y_column} vs {x_column}")
 
-def handle_uploaded_file(uploaded_file):
-    """
-    Handles the file upload and loads the appropriate dataset.
-    Args:
-        uploaded_file: The file uploaded by the user.
-    Returns:
-        data: The dataset loaded as a pandas DataFrame.
-        columns: The column names from the dataset.
-    """
-    if uploaded_file is not None:
-        # Read the file based on its type (CSV, Excel, etc.)
-        file_extension = uploaded_file.name.split('.')[-1].lower()
-        
-        if file_extension == "csv":
-            data = pd.read_csv(uploaded_file)
-        elif file_extension in ["xls", "xlsx"]:
-            data = pd.read_excel(uploaded_file)
-        elif file_extension == "json":
-            data = pd.read_json(uploaded_file)
-        else:
-            st.error("Unsupported file format")
-            return None, None
-        
-        # Display a preview of the dataset
-        preview_uploaded_file(data)
-
-        # Return the loaded dataset and its columns
-        return data, data.columns.tolist()
-    else:
-        st.error("Please upload a file first.")
-        return None, None
+    # Display the bar chart in Streamlit (re-rendered only if this exact chart isn't cached)
+    key = ("bar", x_column, y_column, start_value, end_value, data_fingerprint(selected_data_x, selected_data_y))
+    st.image(render_chart_png(key, draw))